@@ -10,26 +10,249 @@
 
 import os
 import sys
+import io
+import random
+import time
 import argparse
 import shutil
+import mimetypes
+import hashlib
+import json
+import sqlite3
+import threading
+import queue
+from heapq import heappush, heappop
 from pathlib import Path as pt
 import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import textwrap
 try:
     from PIL import Image
     Image.warnings.simplefilter('ignore', Image.DecompressionBombWarning)
 
-    import magic
     from tqdm import tqdm
 except ImportError:
-    raise f"The packages 'Pillow', 'python-magic' and 'tqdm' must be installed " \
+    raise f"The packages 'Pillow' and 'tqdm' must be installed " \
            "to run this program."
 
 __title__ = 'Convert to Webp'
 __license__ = 'MIT'
 __author__ = 'madeddy'
 __status__ = 'Development'
-__version__ = '0.28.2-alpha'
+__version__ = '0.33.0-alpha'
+
+# manifest of the converted files in the target directory
+MANIFEST_NAME = 'c2w_manifest.sqlite'
+
+# name -> WebP encoder settings; `method` goes from 0 (fast) to 6 (small
+# files), for lossless `quality` is the effort
+PRESETS = {'fast': {'method': 0, 'quality': 75},
+           'default': {'method': 3, 'quality': 80},
+           'small': {'method': 6, 'quality': 75, 'alpha_quality': 80},
+           'lossless': {'method': 4, 'lossless': True, 'quality': 60},
+           'lossless-max': {'method': 6, 'lossless': True, 'quality': 100}}
+
+
+def file_digest(src_f):
+    """Returns the hash of the content of a file."""
+    hsh = hashlib.blake2b(digest_size=16)
+    with open(src_f, 'rb') as ofi:
+        for chunk in iter(lambda: ofi.read(1 << 20), b''):
+            hsh.update(chunk)
+    return hsh.hexdigest()
+
+
+def probe_file(src_f, digest=False):
+    """Reads the header of a file once and returns (path, format, animated,
+    error, content hash, pixels, frames); Pillow only parses the header on
+    open, so this is cheap and can run in threads. Non-images and
+    unsupported formats return the error. The hash is only computed on
+    request."""
+    f_hash = None
+    try:
+        if digest:
+            f_hash = file_digest(src_f)
+        with Image.open(src_f) as img:
+            animated = getattr(img, 'is_animated', False)
+            return (src_f, img.format.lower(), animated, None, f_hash,
+                    img.width * img.height, img.n_frames if animated else 1)
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError, OSError) as err:
+        return src_f, None, False, err, f_hash, 0, 1
+
+
+def sample_encode(imgs, params, limit=None):
+    """Encodes the loaded sample images in memory; returns the seconds and
+    the bytes of it. Over the time limit it stops with None as bytes."""
+    secs, size = 0.0, 0
+    for img in imgs:
+        buf = io.BytesIO()
+        t_beg = time.perf_counter()
+        img.save(buf, 'webp', **params)
+        secs += time.perf_counter() - t_beg
+        size += buf.tell()
+        if limit is not None and secs > limit:
+            return secs, None
+    return secs, size
+
+
+def default_pixel_budget():
+    """Decoded pixels which may be in work at once: half of the memory at
+    about 16 byte per pixel for the decoded image and the encoder."""
+    try:
+        mem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return 256 * 10**6
+    return mem // 2 // 16
+
+
+# the C2wMain instance of a pool process; set once by `init_worker`
+_c2w = None
+
+
+def init_worker(c2w, verbosity):
+    """Pool initializer: hands the settings to a worker process once, so the
+    tasks carry only their work item. Works with every start method."""
+    global _c2w  # pylint: disable=w0603
+    C2wCommon.verbosity = verbosity
+    _c2w = c2w
+
+
+def mp_worker(chunk):
+    """Pool task: a list of work items; see `C2wMain.convert`."""
+    return [_c2w.convert(inp) for inp in chunk]
+
+
+class C2wScheduler:
+    """
+    Hands the work items to the pool, longest processing time first: the
+    found items wait in a heap by their estimated cost (pixels x frames)
+    and a free worker always gets the biggest one. The decoded pixels of the
+    running tasks stay below `pixel_budget`; a item over the budget runs
+    alone. Small images are grouped up to `chunksize` per task.
+    """
+
+    small = 1 << 20
+
+    def __init__(self, pool, workers, pixel_budget, chunksize=1):
+        self.pool = pool
+        self.workers = workers
+        self.pixel_budget = pixel_budget
+        self.chunksize = chunksize
+        # found items, finished tasks and errors of the feeder and the pool
+        self.events = queue.Queue()
+        self.heap = []
+        # task nr -> decoded pixels
+        self.running = {}
+        self.used = 0
+        self.order = 0
+
+    @staticmethod
+    def cost(item):
+        """Estimated work of a item: pixels x frames."""
+        return item[2] * item[3]
+
+    def feed(self, work):
+        """Thread target: passes the items of the discovery on."""
+        try:
+            for item in work:
+                self.events.put(('item', item))
+        except Exception as err:  # pylint: disable=w0703
+            self.events.put(('fail', err))
+        self.events.put(('end', None))
+
+    def take(self):
+        """Takes the next task off the heap: the biggest item, followed by
+        more items if they are small."""
+        item = heappop(self.heap)[2]
+        chunk = [item]
+        while self.heap and len(chunk) < self.chunksize and self.cost(item) < self.small:
+            chunk.append(heappop(self.heap)[2])
+        return chunk
+
+    def dispatch(self):
+        """Starts tasks while workers are free and the budget allows."""
+        while self.heap and len(self.running) < self.workers:
+            if self.running and self.used + self.heap[0][2][2] > self.pixel_budget:
+                break
+            chunk = self.take()
+            pixels = max(item[2] for item in chunk)
+            self.order += 1
+            self.running[self.order] = pixels
+            self.used += pixels
+            self.pool.apply_async(mp_worker, (chunk,),
+                                  callback=lambda res, nr=self.order: self.events.put(('done', (nr, res))),
+                                  error_callback=lambda err: self.events.put(('fail', err)))
+
+    def run(self, work):
+        """Yields the results of all items of `work` as they come."""
+        threading.Thread(target=self.feed, args=(work,), daemon=True).start()
+        walking = True
+        while walking or self.heap or self.running:
+            kind, payload = self.events.get()
+            if kind == 'item':
+                self.order += 1
+                heappush(self.heap, (-self.cost(payload), self.order, payload))
+            elif kind == 'end':
+                walking = False
+            elif kind == 'fail':
+                raise payload
+            else:
+                task_nr, results = payload
+                self.used -= self.running.pop(task_nr)
+                yield from results
+            self.dispatch()
+
+
+class C2wManifest:
+    """
+    Persistent record (SQLite) of the converted files in the target directory:
+    relative path, size, mtime, content hash and the encoding settings.
+    The table is read once into a dict; new rows are collected and written
+    by the parent process with `flush`.
+    """
+
+    def __init__(self, db_file, settings):
+        self.settings = settings
+        self.con = sqlite3.connect(str(db_file))
+        self.con.execute("CREATE TABLE IF NOT EXISTS files (relpath TEXT PRIMARY KEY, "
+                         "size INTEGER, mtime_ns INTEGER, hash TEXT, settings TEXT)")
+        self.rows = {row[0]: row[1:] for row in self.con.execute("SELECT * FROM files")}
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def unchanged(self, relpath, fstat):
+        """True if a file was converted with the current settings and its size
+        and mtime are still the same. Costs no read of the file."""
+        row = self.rows.get(relpath)
+        return bool(row and row[3] == self.settings
+                    and row[:2] == (fstat.st_size, fstat.st_mtime_ns))
+
+    def known_hash(self, relpath, fstat):
+        """The stored hash of a file whose mtime changed but not its size; it
+        could be only touched."""
+        row = self.rows.get(relpath)
+        if row and row[3] == self.settings and row[0] == fstat.st_size:
+            return row[2]
+        return None
+
+    def note(self, relpath, size, mtime_ns, f_hash):
+        """Adds a row for the next `flush`; thread safe."""
+        with self.lock:
+            self.pending.append((relpath, size, mtime_ns, f_hash, self.settings))
+
+    def flush(self):
+        """Writes the noted rows."""
+        with self.lock:
+            rows, self.pending = self.pending, []
+        self.con.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows)
+        self.con.commit()
+        for row in rows:
+            self.rows[row[0]] = row[1:]
+
+    def close(self):
+        """Writes the rest and closes the database."""
+        self.flush()
+        self.con.close()
 
 
 class C2wCommon:
@@ -40,11 +263,15 @@ class C2wCommon:
     file_count = {'stl_f_found': 0,
                   'ani_f_found': 0,
                   'fle_skip': 0,
-                  'stl_f_done': mp.Value('i', 0),
-                  'ani_f_done': mp.Value('i', 0)}
+                  'fle_same': 0,
+                  'fle_fail': 0,
+                  'stl_f_done': 0,
+                  'ani_f_done': 0}
     quali = {'quality': 80}
     quali_ani = quali
     ani_ext = ['webp', 'gif']
+    # header reads in flight during the discovery
+    probe_threads = 16
 
     def __str__(self):
         return f"{self.__class__.__name__}({self.name!r})"
@@ -84,6 +311,7 @@ class C2wPathWork(C2wCommon):
         self.src_file = None
         self.recode_webp = None
         self.conv_ani = None
+        self.huge_files = []
 
     def check_inpath(self):
         """Helper to check if given input path exist."""
@@ -98,17 +326,9 @@ class C2wPathWork(C2wCommon):
         if self.bup_pth.is_dir() and any(self.bup_pth.iterdir()):
             raise FileExistsError("Backup dir already exists and has content. Stoping.")
 
-    def test_ani(self, f_type):
-        """Tests if the image a gif/webp and animated is."""
-        return bool(f_type in self.ani_ext and Image.open(self.src_file).is_animated)
-
-    def skip_check(self, m_type, f_type):
+    def skip_check(self, f_type):
         """Different tests wich can cause to skip the file."""
-        return bool(m_type != 'image' or f_type == 'webp' and self.recode_webp is False)
-
-    def get_mimetype(self):
-        """Returns the mime type of a file."""
-        return magic.from_file(str(self.src_file), mime=True).split('/')
+        return bool(f_type == 'webp' and self.recode_webp is False)
 
     def big_img_assert(self, err):
         """Ask's user if to proceed on huge files (DecompressionBombError)."""
@@ -125,46 +345,108 @@ class C2wPathWork(C2wCommon):
                 self.inf(0, f"Proceeding with file {self.src_file}.")
                 return True
 
-    def dirwalker(self):
-        """Searches a directory for images, filters and provides them as a list."""
-
-        img_list = list()
+    def walk_files(self):
+        """Yields all files below the input path."""
         for path, dirs, files in os.walk(self.inpath):
             if 'img_backup' in dirs:
                 dirs.remove('img_backup')
-
             for fln in files:
-                self.src_file = pt(path).joinpath(fln)
-
-                m_type, f_type = self.get_mimetype()
-                if self.skip_check(m_type, f_type):
-                    C2wMain.file_count['fle_skip'] += 1
-                    continue
-                # assert format support early
+                if not fln.startswith(MANIFEST_NAME):
+                    yield pt(path).joinpath(fln)
+
+    def sort_probe(self, probe, manifest=None, huge=False):
+        """Counts a probed file and returns its work item or None if skipped.
+        Huge files which the user accepts wait in `huge_files` for a second
+        probe; `huge` marks the item of such a probe."""
+        self.src_file, f_type, animated, err, f_hash, pixels, frames = probe
+        if f_hash is not None:
+            relpath = str(self.src_file.relative_to(self.inpath))
+            if f_hash == manifest.rows[relpath][2]:
+                # only touched; the conversion is still current
                 try:
-                    Image.open(self.src_file)
-                except Image.UnidentifiedImageError as err:
-                    self.inf(1, f"{err}"
-                             "Format is not supported by Pillow. Skipped.")
+                    fstat = self.src_file.stat()
+                except OSError:
                     C2wMain.file_count['fle_skip'] += 1
-                    continue
-                except Image.DecompressionBombError as err:
-                    if not self.big_img_assert(err):
-                        continue
-
-                if self.test_ani(f_type) is False:
-                    C2wMain.file_count['stl_f_found'] += 1
-                    img_list.append((self.src_file, "stl"))
-                else:
-                    if self.conv_ani is True:
-                        # placing counter in worker funcs doesn't work
-                        C2wMain.file_count['ani_f_found'] += 1
-                        img_list.append((self.src_file, "ani"))
-                    else:
+                    return None
+                manifest.note(relpath, fstat.st_size, fstat.st_mtime_ns, f_hash)
+                C2wMain.file_count['fle_same'] += 1
+                return None
+        if isinstance(err, Image.DecompressionBombError):
+            if self.big_img_assert(err):
+                self.huge_files.append(self.src_file)
+            return None
+        if err is not None:
+            if (mimetypes.guess_type(self.src_file.name)[0] or '').startswith('image'):
+                self.inf(1, f"{err}"
+                         "Format is not supported by Pillow. Skipped.")
+            C2wMain.file_count['fle_skip'] += 1
+            return None
+        if self.skip_check(f_type):
+            C2wMain.file_count['fle_skip'] += 1
+            return None
+
+        if not (f_type in self.ani_ext and animated):
+            C2wMain.file_count['stl_f_found'] += 1
+            return self.src_file, "stl", pixels, 1, huge
+        if self.conv_ani is True:
+            C2wMain.file_count['ani_f_found'] += 1
+            return self.src_file, "ani", pixels, frames, huge
+        C2wMain.file_count['fle_skip'] += 1
+        return None
+
+    def probe_huge(self):
+        """Probes the accepted huge files again with the size limit of Pillow
+        lifted and yields their work items. Runs after the probe threads are
+        done, which keep the limit."""
+        huge_files, self.huge_files = self.huge_files, []
+        for src_f in huge_files:
+            limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+            try:
+                probe = probe_file(src_f)
+            finally:
+                Image.MAX_IMAGE_PIXELS = limit
+            item = self.sort_probe(probe, huge=True)
+            if item is not None:
+                yield item
+
+    def dirwalker(self, manifest=None):
+        """
+        Searches a directory for images, filters them and yields the work
+        items as they are found. Type and animation come from one header
+        read per file; the reads run in a thread pool, so the conversion can
+        start long before the walk is done. Files which the manifest knows
+        as converted are skipped after a stat (or a hash if only the mtime
+        changed).
+        """
+        with ThreadPoolExecutor(self.probe_threads) as tpe:
+            pending = set()
+            for src_f in self.walk_files():
+                digest = False
+                if manifest is not None:
+                    relpath = str(src_f.relative_to(self.inpath))
+                    try:
+                        fstat = src_f.stat()
+                    except OSError:
+                        # dangling link or vanished file
                         C2wMain.file_count['fle_skip'] += 1
                         continue
-
-        return img_list
+                    if manifest.unchanged(relpath, fstat):
+                        C2wMain.file_count['fle_same'] += 1
+                        continue
+                    digest = manifest.known_hash(relpath, fstat) is not None
+                pending.add(tpe.submit(probe_file, src_f, digest))
+                if len(pending) < 4 * self.probe_threads:
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    item = self.sort_probe(fut.result(), manifest)
+                    if item is not None:
+                        yield item
+            for fut in pending:
+                item = self.sort_probe(fut.result(), manifest)
+                if item is not None:
+                    yield item
+        yield from self.probe_huge()
 
 
 class C2wMain(C2wPathWork):
@@ -175,31 +457,129 @@ class C2wMain(C2wPathWork):
             C2wCommon.verbosity = verbose
         super().__init__()
         self.inpath = pt(inp)
-        self.set_quali(quali, ani_mix)
+        self.set_quali(quali, ani_mix, kwargs.get('preset'))
+        # ('speed', megapixels per second) or ('size', ratio to the smallest)
+        self.auto = kwargs.get('auto')
+        if self.auto and self.auto[0] == 'size' and self.auto[1] < 1:
+            raise ValueError("The size ratio of the auto mode must be at least 1.")
+        self.auto_samples = 8
+        # pixels of the whole sample (a image up to a quarter of it); a
+        # method whose trial takes longer than `auto_secs` ends the tuning,
+        # the higher ones are slower
+        self.auto_pixels = 10**6
+        self.auto_secs = 10.0
         self.recode_webp = kwargs.get('recode_webp')
         self.conv_ani = kwargs.get('conv_ani')
         self.handle_src = kwargs.get('handle_src')
+        self.use_manifest = kwargs.get('use_manifest', True)
+        self.full = kwargs.get('full')
+        # small images per pool task; more saves IPC on many small files
+        self.chunksize = kwargs.get('chunksize') or 4
+        self.jobs = kwargs.get('jobs')
+        self.pixel_budget = kwargs.get('pixel_budget') or default_pixel_budget()
 
     # TODO: Quali setting in init... overhaul it
-    def set_quali(self, quali, ani_mix):
-        """Sets the quali state."""
-        if quali is True:
+    def set_quali(self, quali, ani_mix, preset=None):
+        """Sets the quali state from a preset (see `PRESETS`); a given quality
+        or lossless switch overrides the one of the preset."""
+        if preset not in PRESETS and preset is not None:
+            raise ValueError(f"Unknown preset {preset!r}.")
+        self.quali = dict(PRESETS[preset or 'default'])
+        self.method = self.quali.pop('method')
+        if quali is True and not self.quali.get('lossless'):
             self.quali = {'lossless': quali}
         elif type(quali) is int:
             if not 0 <= quali <= 100:
                 raise ValueError("Invalid number input for quality argument.")
-            self.quali = {'quality': quali}
+            self.quali.pop('lossless', None)
+            self.quali['quality'] = quali
 
         self.quali_ani = {'allow_mixed': True} if ani_mix else self.quali
 
+    def settings_key(self):
+        """The encoding settings as stored in the manifest. In auto mode the
+        target stands for the method, which can vary between the runs."""
+        settings = {'quali': self.quali, 'quali_ani': self.quali_ani, 'method': self.method}
+        if self.auto:
+            settings.update(method=None, auto=list(self.auto))
+        return json.dumps(settings, sort_keys=True)
+
+    def sample_images(self):
+        """Loads a random sample of the still images among the first ones
+        found; together up to `auto_pixels`."""
+        found = []
+        for num, src_f in enumerate(self.walk_files()):
+            if num >= 1000 or len(found) >= 8 * self.auto_samples:
+                break
+            _src_f, f_type, animated, err, _f_hash, pixels, _frames = probe_file(src_f)
+            if err is None and not animated and pixels <= self.auto_pixels // 4 and not self.skip_check(f_type):
+                found.append((src_f, pixels))
+        random.Random(0).shuffle(found)
+        imgs, total = [], 0
+        for src_f, pixels in found:
+            if len(imgs) >= self.auto_samples or total + pixels > self.auto_pixels:
+                continue
+            total += pixels
+            with Image.open(src_f) as ofi:
+                ofi.load()
+                imgs.append(ofi.copy())
+        return imgs
+
+    def auto_tune(self):
+        """
+        Picks the method (and for lossless the effort) for the auto target:
+        a sample is encoded with every method, then
+        speed - the smallest output among the methods with at least the
+                given megapixels per second (else the fastest)
+        size  - the fastest method whose output is at most the given ratio
+                of the smallest output
+        """
+        imgs = self.sample_images()
+        if not imgs:
+            self.inf(1, f"No images to tune with; keeping method {self.method}.", m_sort='note')
+            return
+        mpx = sum(img.width * img.height for img in imgs) / 10**6
+        trials = []
+        for method in range(7):
+            params = dict(self.quali, method=method)
+            if params.get('lossless'):
+                params['quality'] = round(method * 100 / 6)
+            secs, size = sample_encode(imgs, params, self.auto_secs)
+            if size is None:
+                self.inf(2, f"Method {method} and higher are left out; too slow.")
+                break
+            trials.append((mpx / max(secs, 1e-9), size, params))
+            self.inf(2, f"Method {method}: {trials[-1][0]:.2f} MP/s, {size} bytes")
+        if not trials:
+            self.inf(1, f"Even method 0 is too slow on the sample; keeping method {self.method}.",
+                     m_sort='note')
+            return
+
+        kind, target = self.auto
+        if kind == 'speed':
+            fast = [trial for trial in trials if trial[0] >= target]
+            pick = min(fast, key=lambda trial: trial[1]) if fast else max(trials, key=lambda trial: trial[0])
+        else:
+            smallest = min(trial[1] for trial in trials)
+            pick = max((trial for trial in trials if trial[1] <= smallest * target),
+                       key=lambda trial: trial[0], default=None)
+            if pick is None:
+                pick = min(trials, key=lambda trial: trial[1])
+        params = dict(pick[2])
+        self.method = params.pop('method')
+        # `quali_ani` can be the same dict
+        self.quali.update(params)
+        self.inf(1, f"Auto tuning picked method {self.method} ({pick[0]:.2f} MP/s on the sample).")
+
     def begin_msg(self):
         """Outputs a info about the start state if verbosity is high."""
-        if 'quality' in self.quali.keys():
+        if 'lossless' in self.quali.keys():
+            self.inf(2, "Encoding is set to lossless.")
+        elif 'quality' in self.quali.keys():
             if 80 in self.quali.values():
                 self.inf(2, f"Encoding stays at standard: lossy, with quality 80.")
             self.inf(1, f"Quality factor is set to: {self.quali['quality']!s}")
-        elif 'lossless' in self.quali.keys():
-            self.inf(2, "Encoding is set to lossless.")
+        self.inf(2, f"Encoder method: {self.method!s}")
         if 'allow_mixed' in self.quali_ani.keys():
             self.inf(2, "Animated images are set to mixed compression.")
 
@@ -220,39 +600,57 @@ class C2wMain(C2wPathWork):
     def stl_converter(self, src, dst):
         """Convert method for still images."""
         with Image.open(src) as ofi:
-            ofi.save(dst, 'webp', **self.quali, method=3)
-        with C2wMain.file_count['stl_f_done'].get_lock():
-            C2wMain.file_count['stl_f_done'].value += 1
+            ofi.save(dst, 'webp', **self.quali, method=self.method)
 
     def ani_converter(self, src, dst):
         """Convert method for animated images.
         # NOTE: needs duration arg or the conv. anim. files play too slow"""
         with Image.open(src) as ofi:
-            ofi.save(dst, 'webp', **self.quali_ani, duration=ofi.info['duration'], save_all=True, method=3)
-        with C2wMain.file_count['ani_f_done'].get_lock():
-            C2wMain.file_count['ani_f_done'].value += 1
-
-    def mp_worker(self, inp):
-        """Convert method for images with multiprocessing capapility."""
-        mp_conv_f, img_state = inp
+            ofi.save(dst, 'webp', **self.quali_ani, duration=ofi.info['duration'], save_all=True, method=self.method)
+
+    def manifest_row(self, img_f):
+        """Relative path, size, mtime and hash of a file for the manifest."""
+        fstat = img_f.stat()
+        return (str(img_f.relative_to(self.inpath)), fstat.st_size, fstat.st_mtime_ns,
+                file_digest(img_f))
+
+    def convert(self, inp):
+        """Converts one work item in a pool process. Returns the file, its
+        state, the error (None on success) and the manifest rows of source
+        and result; the parent does the counting. For huge images which
+        the user accepted the size limit of Pillow is lifted meanwhile."""
+        mp_conv_f, img_state, _pixels, _frames, huge = inp
         dst_f = pt(mp_conv_f).with_suffix('.webp')
-
+        rows = []
+        limit = Image.MAX_IMAGE_PIXELS
+        if huge:
+            Image.MAX_IMAGE_PIXELS = None
         try:
+            if self.use_manifest and dst_f != mp_conv_f:
+                rows.append(self.manifest_row(mp_conv_f))
             if img_state == "stl":
                 self.stl_converter(mp_conv_f, dst_f)
             elif img_state == "ani":
                 self.ani_converter(mp_conv_f, dst_f)
-        except OSError:
-            self.inf(1, f"Image {mp_conv_f} could not be converted.")
-
-        if self.handle_src:
-            self.orgs_switch(mp_conv_f)
-
-    @staticmethod
-    def set_cpu_num():
-        """Sets the number of used CPUs."""
-        num_cpu = os.cpu_count()
-        return round(num_cpu * 0.75) if num_cpu > 2 else 1
+            if self.use_manifest:
+                rows.append(self.manifest_row(dst_f))
+            if self.handle_src:
+                self.orgs_switch(mp_conv_f)
+        except Exception as err:  # pylint: disable=w0703
+            # any failure belongs to this image; the batch goes on
+            return mp_conv_f, img_state, f"{type(err).__name__}: {err}", []
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+        return mp_conv_f, img_state, None, rows
+
+    def set_cpu_num(self):
+        """Sets the number of used CPUs; all usable ones if not given. The
+        pixel budget keeps the memory in check."""
+        if self.jobs:
+            return self.jobs
+        if hasattr(os, 'sched_getaffinity'):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
 
     def c2w_control(self):
         """This manages all processing steps."""
@@ -260,19 +658,42 @@ class C2wMain(C2wPathWork):
         self.check_inpath()
         self.check_bup()
 
-        img_list = self.dirwalker()
-        item_count = C2wMain.file_count['stl_f_found'] \
-                   + C2wMain.file_count['ani_f_found']
         mp_count = self.set_cpu_num()
-
-        with mp.Pool(mp_count) as pool:
-            for _ in tqdm(pool.imap_unordered(self.mp_worker, img_list),
-                          total=item_count, unit='files'):
-                pass
-
-        self.inf(1, "Completed."
-                 f"{C2wMain.file_count['stl_f_done'].value!s} still images where "
+        manifest = None
+        if self.use_manifest:
+            manifest = C2wManifest(self.inpath.joinpath(MANIFEST_NAME), self.settings_key())
+        if self.auto:
+            self.auto_tune()
+
+        # the scheduler takes the work items from the discovery as they
+        # come; the total is not known before the walk ends
+        work = self.dirwalker(None if self.full else manifest)
+        with mp.Pool(mp_count, init_worker, (self, C2wCommon.verbosity)) as pool:
+            scheduler = C2wScheduler(pool, mp_count, self.pixel_budget, self.chunksize)
+            results = scheduler.run(work)
+            for num, (src_f, img_state, err, rows) in enumerate(tqdm(results, unit='files')):
+                if err is not None:
+                    self.inf(1, f"Image {src_f} could not be converted. {err}")
+                    C2wMain.file_count['fle_fail'] += 1
+                else:
+                    C2wMain.file_count[f'{img_state}_f_done'] += 1
+                if manifest is None:
+                    continue
+                for row in rows:
+                    manifest.note(*row)
+                if num % 500 == 499:
+                    manifest.flush()
+        if manifest is not None:
+            manifest.close()
+
+        self.inf(1, "Completed. "
+                 f"{C2wMain.file_count['stl_f_done']!s} still and "
+                 f"{C2wMain.file_count['ani_f_done']!s} animated images where "
                  f"converted and {C2wMain.file_count['fle_skip']!s} files omitted.")
+        if C2wMain.file_count['fle_fail']:
+            self.inf(1, f"{C2wMain.file_count['fle_fail']!s} images could not be converted.", m_sort='warn')
+        if self.use_manifest:
+            self.inf(2, f"{C2wMain.file_count['fle_same']!s} files were unchanged since the last run.")
 
 
 def parse_args():
@@ -288,6 +709,20 @@ def parse_args():
             raise ValueError("Invalid number input for quality argument.")
         return input_nr
 
+    def positive(inp):
+        """Validates a positive number."""
+        value = float(inp)
+        if value <= 0:
+            raise argparse.ArgumentTypeError("Must be greater than 0.")
+        return value
+
+    def valid_ratio(inp):
+        """Validates the size ratio of the auto mode; 1 or more."""
+        value = float(inp)
+        if value < 1:
+            raise argparse.ArgumentTypeError("The size ratio must be at least 1, e.g. 1.05.")
+        return value
+
     aps = argparse.ArgumentParser(
         description='A program for converting tiff, png, jpeg, gif images to webp or encode webp anew.\nEXAMPLE USAGE: convert_to_webp.py -q 90',
         epilog='The switches are optional. Without one of them the default quality is lossy -q 80 and the orginal files will be retained.')
@@ -305,6 +740,19 @@ def parse_args():
                         type=valid_nr,
                         dest='qua',
                         help='Set quality to lossy. Value 0-100')
+    aps.add_argument('-p', '--preset',
+                     choices=PRESETS,
+                     help='Encoder preset: fast, default, small, lossless or lossless-max. '
+                          '-q/-l override its quality.')
+    auto = aps.add_mutually_exclusive_group()
+    auto.add_argument('--auto-speed',
+                      type=positive,
+                      metavar='MP/s',
+                      help='Tune the method on a sample: smallest output with this throughput.')
+    auto.add_argument('--auto-size',
+                      type=valid_ratio,
+                      metavar='ratio',
+                      help='Tune the method on a sample: fastest with at most ratio x the smallest output, e.g. 1.05.')
     aps.add_argument('-m',
                      action='store_true',
                      dest='ani_m',
@@ -328,6 +776,21 @@ def parse_args():
                      action='store_true',
                      dest='c_ani',
                      help='Convert animated gif images to webp.')
+    aps.add_argument('--full',
+                     action='store_true',
+                     dest='full',
+                     help='Ignore the manifest of the last runs and convert all images anew.')
+    aps.add_argument('--chunksize',
+                     type=int,
+                     default=4,
+                     help='Small images (< 1 megapixel) per task of a worker process. default:4')
+    aps.add_argument('-j', '--jobs',
+                     type=int,
+                     help='Number of worker processes. default: all CPUs')
+    aps.add_argument('--pixel-budget',
+                     type=lambda inp: int(float(inp) * 10**6),
+                     metavar='megapixels',
+                     help='Decoded pixels in work at once. default: half of the memory')
     aps.add_argument('--verbose',
                      metavar='level [0-2]',
                      type=int,
@@ -346,8 +809,15 @@ def main(cfg):
     if not sys.version_info[:2] >= (3, 6):
         raise Exception("Must be executed in Python 3.6 or later.\n"
                         f"You are running {sys.version}")
+    auto = None
+    if cfg.auto_speed is not None:
+        auto = ('speed', cfg.auto_speed)
+    elif cfg.auto_size is not None:
+        auto = ('size', cfg.auto_size)
     c2w = C2wMain(cfg.inp, cfg.qua, cfg.ani_m, cfg.verbose,
-                  recode_webp=cfg.r_webp, conv_ani=cfg.c_ani, handle_src=cfg.orgs)
+                  recode_webp=cfg.r_webp, conv_ani=cfg.c_ani, handle_src=cfg.orgs,
+                  full=cfg.full, chunksize=cfg.chunksize, jobs=cfg.jobs,
+                  pixel_budget=cfg.pixel_budget, preset=cfg.preset, auto=auto)
     c2w.c2w_control()
 
 
@@ -9,15 +9,88 @@
 import sys
 from pathlib import Path
 import argparse
+import random
 from heapq import heappop, heappush
-import dill as pickle
-from graphdata.graphinfo import gridsize
+from time import perf_counter
+import numpy as np
+from csrgraph import DIRS, CsrGraph
 
 __title__ = 'astar_search'
 __license__ = 'MIT'
 __author__ = 'madeddy'
 __status__ = 'Development'
-__version__ = '0.15.0-alpha'
+__version__ = '0.23.0-alpha'
+
+
+class SearchProbe:
+    '''
+    Optional instrumentation of the searches; a search without probe (or
+    not sampled) runs the plain loop with just one `None` check per
+    expansion. A sampled search adds to its `stats` the peak frontier size
+    and the timings of search and path reconstruction, counts every
+    expanded node in `heatmap` (if a gridsize is given) and calls
+    `on_expand(node)`. `sample_rate` < 1 instruments only that share of
+    the searches, cheap enough to keep it on in production.
+    '''
+
+    def __init__(self, gridsize=None, on_expand=None, sample_rate=1.0, seed=None):
+        self.heatmap = np.zeros(gridsize, dtype=np.uint32) if gridsize is not None else None
+        self.on_expand = on_expand
+        self.sample_rate = sample_rate
+        self.rand = random.Random(seed)
+        self.searches = 0
+        # stats dicts of the sampled searches
+        self.records = []
+
+    def sample(self):
+        '''Decides if the next search gets instrumented.'''
+        self.searches += 1
+        return self.sample_rate >= 1 or self.rand.random() < self.sample_rate
+
+    def expand(self, node):
+        '''Notes one expanded node.'''
+        if self.heatmap is not None:
+            self.heatmap[node] += 1
+        if self.on_expand is not None:
+            self.on_expand(node)
+
+    def record(self, stats):
+        '''Keeps the stats of a sampled search.'''
+        self.records.append(dict(stats))
+
+    def summary(self):
+        '''Totals and maxima over the sampled searches.'''
+        summary = {'searches': self.searches, 'sampled': len(self.records)}
+        for key in ('expanded', 'pushes', 'pops', 'stale', 'search_s', 'reconstruct_s'):
+            summary[key] = sum(rec.get(key, 0) for rec in self.records)
+        summary['max_frontier'] = max((rec.get('max_frontier', 0) for rec in self.records), default=0)
+        return summary
+
+    def save_heatmap(self, filepath):
+        '''Stores the heatmap of expanded nodes as numpy file.'''
+        np.save(filepath, self.heatmap)
+
+
+class CostTable:
+    '''
+    Terrain cost matrix prepared for the searches: a view per row, which
+    indexes faster than numpy, and the heuristic scale (the cheapest
+    walkable cost). Build it once per matrix and hand it to every search.
+    The views follow in-place changes of the matrix (`M2G.patch`); after
+    cheaper terrain was patched in `refresh` must renew `hscale`.
+    '''
+
+    def __init__(self, costs):
+        self.costs = costs
+        self.rows = [memoryview(row) for row in np.asarray(costs, dtype=np.float32)]
+        self.hscale = 1
+        self.refresh()
+
+    def refresh(self):
+        '''Recomputes the heuristic scale.'''
+        costs = np.asarray(self.costs)
+        walkable = costs[costs > 0]
+        self.hscale = float(walkable.min()) if walkable.size else 1
 
 
 class GraphPathSearch:
@@ -25,17 +98,32 @@ class GraphPathSearch:
 
     diag = -0.5857864376269049
 
-    def __init__(self, graphdict, start, goal):
+    def __init__(self, graphdict, start, goal, labels=None, costs=None, probe=None):
         self.graph = graphdict
         self.start = start
         self.goal = goal
         self.explored = {}
         self.pathway = []
+        # component labels and terrain costs of maze2graph; a CSR graph
+        # carries them itself
+        self.labels = labels if labels is not None else getattr(graphdict, 'labels', None)
+        self.costs = None
+        # the heuristic is scaled to the cheapest terrain to stay admissible
+        self.hscale = 1
+        self.set_costs(costs if costs is not None else getattr(graphdict, 'costs', None))
+        # counters of the last search: expanded nodes, heap pushes and pops,
+        # popped entries of already closed nodes
+        self.stats = {}
+        # optional `SearchProbe`
+        self.probe = probe
 
     def reconstruct_path(self):
         '''This reconstructs the pathway from the explored list of the
            A* search and returns it.'''
 
+        if self.goal not in self.explored:
+            # no path found; pathway stays empty
+            return
         cur_node = self.goal
         while cur_node != self.start:
             self.pathway.append(cur_node)
@@ -44,6 +132,42 @@ class GraphPathSearch:
         self.pathway.append(self.start)
         self.pathway.reverse()
 
+    def neighbors(self, node):
+        '''Returns the linked nodes of a node with their direction.'''
+        return self.graph[node]
+
+    def set_costs(self, costs):
+        '''Takes a terrain cost matrix (see `M2G.terrain_costs`) or a prepared
+        `CostTable` in. A matrix of a CSR graph gets its table cached on the
+        graph, so only the first search pays the preparation.'''
+        if costs is None:
+            return
+        if not isinstance(costs, CostTable):
+            table = getattr(self.graph, 'cost_table', None)
+            if table is None or table.costs is not costs:
+                table = CostTable(costs)
+                if isinstance(self.graph, CsrGraph):
+                    self.graph.cost_table = table
+            costs = table
+        self.costs = costs.rows
+        self.hscale = costs.hscale
+
+    def step_cost(self, current, nxt_node):
+        '''Cost of a move between two neighbor nodes: the step length, with
+        terrain costs times the mean cost of both cells.'''
+        if self.costs is None:
+            return self.heuristic(current, nxt_node)
+        return self.heuristic(current, nxt_node) * 0.5 * (
+            self.costs[current[0]][current[1]] + self.costs[nxt_node[0]][nxt_node[1]])
+
+    def reachable(self):
+        '''Checks in O(1) with the component labels if start and goal are in
+        the same walkable area. Without labels that's unknown; then True.'''
+        if self.labels is None:
+            return True
+        label = self.labels[self.start]
+        return label != 0 and label == self.labels[self.goal]
+
     @classmethod
     def heuristic(cls, source, target):
         '''
@@ -58,70 +182,235 @@ class GraphPathSearch:
         y_dif = abs(source[1] - target[1])
         return (x_dif + y_dif) + cls.diag * min(x_dif, y_dif)
 
+    def start_probe(self):
+        '''Returns the probe if this search gets instrumented, else None.'''
+        if self.probe is not None and self.probe.sample():
+            return self.probe
+        return None
+
+    def finish_probe(self, probe, t_beg, t_mid, max_frontier):
+        '''Adds peak frontier and phase timings to the stats of a sampled
+        search and hands them to the probe.'''
+        self.stats.update(max_frontier=max_frontier, search_s=t_mid - t_beg,
+                          reconstruct_s=perf_counter() - t_mid)
+        probe.record(self.stats)
+
     def a_star_pathsearch(self):
         '''A-star search'''
 
+        if not self.reachable():
+            return self.pathway, {}
+
+        probe = self.start_probe()
+        on_expand = probe.expand if probe is not None else None
+        t_beg = perf_counter() if probe is not None else 0
+        max_frontier = 1
+
         frontier = []
         heappush(frontier, (0, self.start))
         self.explored = {self.start: None}
         cur_cost = {self.start: 0}
+        closed = set()
+        expanded, pushes, pops, stale = 0, 1, 0, 0
 
         while frontier:
             current = heappop(frontier)[1]
+            pops += 1
             if current == self.goal:
                 break
+            # a node gets pushed again on every cost improvement; with a
+            # consistent heuristic the first pop is the final one
+            if current in closed:
+                stale += 1
+                continue
+            closed.add(current)
+            expanded += 1
 
-            # instead node_dir could the wheight be taken from there
-            for nxt_node, _node_dir in self.graph[current]:
-                # replace the + 1/heur. in the next line with wheight costs
-                new_cost = cur_cost[current] + self.heuristic(current, nxt_node)
+            for nxt_node, _node_dir in self.neighbors(current):
+                new_cost = cur_cost[current] + self.step_cost(current, nxt_node)
                 if nxt_node not in cur_cost or new_cost < cur_cost[nxt_node]:
                     cur_cost[nxt_node] = new_cost
-                    priority = new_cost + self.heuristic(nxt_node, self.goal)
+                    priority = new_cost + self.hscale * self.heuristic(nxt_node, self.goal)
                     # print(f'new_cost: {new_cost}  prio: {priority}')
                     heappush(frontier, (priority, nxt_node))
+                    pushes += 1
                     self.explored[nxt_node] = current
+            if on_expand is not None:
+                on_expand(current)
+                # the frontier grows only by the pushes of a expansion
+                max_frontier = max(max_frontier, len(frontier))
 
+        self.stats = {'expanded': expanded, 'pushes': pushes, 'pops': pops, 'stale': stale}
+        if probe is None:
+            self.reconstruct_path()
+            return self.pathway, cur_cost
+        t_mid = perf_counter()
         self.reconstruct_path()
+        self.finish_probe(probe, t_beg, t_mid, max_frontier)
         return self.pathway, cur_cost
 
+    def bidirectional_pathsearch(self):
+        '''
+        Bidirectional A*: one search from the start, one from the goal (each
+        with the heuristic to its own target); always the side with the
+        smaller frontier expands. Every link to a node the other side has
+        reached is a candidate path. The search stops as soon as the best
+        candidate is not longer than the smallest priority of one of the
+        frontiers; no shorter path can exist then. Needs symmetric links,
+        like all graphs of maze2graph have.
+        Returns the pathway and the costs of the forward search, with the
+        path costs under the goal key.
+        '''
+
+        if not self.reachable():
+            return self.pathway, {}
+
+        probe = self.start_probe()
+        on_expand = probe.expand if probe is not None else None
+        t_beg = perf_counter() if probe is not None else 0
+        max_frontier = 2
+        targets = (self.goal, self.start)
+        frontiers = ([(0, self.start)], [(0, self.goal)])
+        costs = ({self.start: 0}, {self.goal: 0})
+        parents = ({self.start: None}, {self.goal: None})
+        closed = (set(), set())
+        best, meet = (0, self.start) if self.start == self.goal else (float('inf'), None)
+        expanded, pushes, pops, stale = 0, 2, 0, 0
+
+        while frontiers[0] and frontiers[1]:
+            if max(frontiers[0][0][0], frontiers[1][0][0]) >= best:
+                break
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            current = heappop(frontiers[side])[1]
+            pops += 1
+            if current in closed[side]:
+                stale += 1
+                continue
+            closed[side].add(current)
+            expanded += 1
+
+            cur_cost, other_cost = costs[side], costs[1 - side]
+            for nxt_node, _node_dir in self.neighbors(current):
+                new_cost = cur_cost[current] + self.step_cost(current, nxt_node)
+                if nxt_node not in cur_cost or new_cost < cur_cost[nxt_node]:
+                    cur_cost[nxt_node] = new_cost
+                    parents[side][nxt_node] = current
+                    priority = new_cost + self.hscale * self.heuristic(nxt_node, targets[side])
+                    heappush(frontiers[side], (priority, nxt_node))
+                    pushes += 1
+                    if nxt_node in other_cost and new_cost + other_cost[nxt_node] < best:
+                        best, meet = new_cost + other_cost[nxt_node], nxt_node
+            if on_expand is not None:
+                on_expand(current)
+                max_frontier = max(max_frontier, len(frontiers[0]) + len(frontiers[1]))
+
+        self.stats = {'expanded': expanded, 'pushes': pushes, 'pops': pops, 'stale': stale}
+        t_mid = perf_counter() if probe is not None else 0
+        if meet is None:
+            if probe is not None:
+                self.finish_probe(probe, t_beg, t_mid, max_frontier)
+            return self.pathway, costs[0]
+
+        cur_node = meet
+        while cur_node is not None:
+            self.pathway.append(cur_node)
+            cur_node = parents[0][cur_node]
+        self.pathway.reverse()
+        cur_node = parents[1][meet]
+        while cur_node is not None:
+            self.pathway.append(cur_node)
+            cur_node = parents[1][cur_node]
+        self.explored = parents[0]
+        costs[0][self.goal] = best
+        if probe is not None:
+            self.finish_probe(probe, t_beg, t_mid, max_frontier)
+        return self.pathway, costs[0]
+
+
+class GridPathSearch(GraphPathSearch):
+    '''A* directly on a walkability matrix like `M2G.mtrx`. The neighbors
+    of a cell are generated on the fly, so no graph must be build before.'''
+
+    def __init__(self, mtrx, start, goal, labels=None, costs=None, probe=None):
+        super().__init__(None, start, goal, labels, costs, probe)
+        self.gsy, self.gsx = mtrx.shape
+        # one byte per cell; the unwalkable border spares any range checks
+        self.walk = [bytes(row) for row in np.pad(mtrx != 0, 1).astype(np.uint8)]
+
+    def neighbors(self, node):
+        '''Returns the walkable neighbor cells of a cell in `DIRS` order.'''
+        y_pos, x_pos = node
+        walk = self.walk
+        return [((y_pos + d_y, x_pos + d_x), d_name) for d_name, (d_y, d_x) in DIRS
+                if walk[y_pos + 1 + d_y][x_pos + 1 + d_x]]
+
 
 def save_path(pathway):
     '''This writes the found pathway to a file.'''
+    if not Path('graphdata').exists():
+        Path('graphdata').mkdir(parents=True, exist_ok=True)
     with open('graphdata/pathsearch_sol.txt', 'w') as nfi:
         print('A* solution return: \n', pathway, file=nfi)
 
 
 def get_args():
-    '''Parses function: Takes just the graph file in and validates her. '''
+    '''Parses function: Takes just the graph or image file in and validates her. '''
 
     def valid_file(infilename):
         '''Helper to test the given string for the infilename.'''
 
         if not Path(infilename).is_file():
             raise parser.error('Input file not found.')
-        if Path(infilename).suffix not in '.pickle':
-            raise parser.error('Input must be a pickle file.')
         return infilename
 
     parser = argparse.ArgumentParser(description='Finds path from a source point to a target in the stored graph.')
     parser.add_argument('graph_file', action='store', type=valid_file,
                         metavar='Graph file',
-                        help='File with graph for processing.')
+                        help='File with graph (m2g, npz) or a mask image to search directly.')
+    parser.add_argument('--bidir', action='store_true',
+                        help='Search bidirectional; from start and goal at once.')
+    parser.add_argument('--stats', action='store_true',
+                        help='Instrument the search; prints the counters and timings and '
+                             'stores a heatmap of expanded nodes in graphdata/heatmap.npy.')
+    parser.add_argument('--smooth', action='store_true',
+                        help='Reduce the path to its any-angle waypoints (line of sight).')
     return parser.parse_args()
 
 
 def main(cfg):
     '''...main function.'''
 
-    with open(cfg.graph_file, 'rb') as nfi:
-        graphdict = pickle.load(nfi)
+    suffix = Path(cfg.graph_file).suffix
+    if suffix in ('.npz', '.m2g'):
+        # the graph files carry grid size, labels and costs themselves
+        graphdict = CsrGraph.load(cfg.graph_file) if suffix == '.npz' else CsrGraph.read(cfg.graph_file)
+        gridsize = graphdict.gridsize
+    else:
+        # a mask image: search the grid without building a graph
+        from maze2graph import M2G
+        m2g = M2G(cfg.graph_file)
+        mtrx, labels = m2g.mtrx, m2g.label_components()
+        gridsize = mtrx.shape
 
     start, goal = (1, 1), (gridsize[0] - 2, gridsize[1] - 2)
-    gps = GraphPathSearch(graphdict, start, goal)
+    probe = SearchProbe(gridsize) if cfg.stats else None
+    if suffix in ('.npz', '.m2g'):
+        gps = GraphPathSearch(graphdict, start, goal, probe=probe)
+    else:
+        gps = GridPathSearch(mtrx, start, goal, labels, probe=probe)
 
-    found_path, cost = gps.a_star_pathsearch()
+    if cfg.bidir:
+        found_path, cost = gps.bidirectional_pathsearch()
+    else:
+        found_path, cost = gps.a_star_pathsearch()
+    if cfg.smooth:
+        from path_smoothing import PathSmoother
+        smoother = PathSmoother.from_graph(graphdict) if suffix in ('.npz', '.m2g') else PathSmoother(mtrx)
+        found_path = smoother.smooth(found_path)
     save_path(found_path)
+    if probe is not None:
+        print(gps.stats)
+        probe.save_heatmap('graphdata/heatmap.npy')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+'''
+Compact graph format for the walkable area of a map. Nodes get integer ids in
+row-major order; the links live in CSR (compressed sparse row) arrays.
+'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+import struct
+import numpy as np
+
+__title__ = 'csrgraph'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.5.0-alpha'
+
+# Neighbor table; ordered like the loop build in maze2graph appends the
+# links of a node: ('dir name', (coord change value))
+DIRS = (('NW', (-1, -1)), ('N', (-1, 0)), ('W', (0, -1)), ('NE', (-1, 1)),
+        ('E', (0, 1)), ('SE', (1, 1)), ('S', (1, 0)), ('SW', (1, -1)))
+DIR_NAMES = tuple(d_name for d_name, _d_val in DIRS)
+# dir name -> name of the reverse direction
+REV_DIRS = {d_name: r_name for d_name, (d_y, d_x) in DIRS
+            for r_name, (r_y, r_x) in DIRS if (r_y, r_x) == (-d_y, -d_x)}
+
+# Binary graph file (`CsrGraph.write`): a fixed header, a table with the
+# file offset of every array (0 = not stored) and the raw little-endian
+# arrays, each 64 byte aligned so they can be memory-mapped.
+MAGIC = b'M2GRAPH\x00'
+FORMAT_VERSION = 1
+# magic, format version, flags, gsy, gsx, keycount, valcount
+HEADER = struct.Struct('<8sHHqqqq')
+SECTIONS = ('cells', 'offsets', 'neighbors', 'dircodes', 'labels', 'costs')
+SECTION_TABLE = struct.Struct(f'<{len(SECTIONS)}Q')
+FLAG_CELLS64 = 1
+ALIGN = 64
+
+
+class CsrGraph:
+    '''
+    Adjacency graph in CSR layout:
+    cells      - flat grid position (y * gsx + x) of every node id, ascending
+    offsets    - links of node id `i` are in the slice offsets[i]:offsets[i+1]
+    neighbors  - node id of the linked node
+    dircodes   - uint8 index into `DIRS` for every link
+    labels     - optional component label matrix (see maze2graph)
+    costs      - optional float32 terrain cost matrix (see `M2G.terrain_costs`)
+
+    As mapping it answers like the graph dict of maze2graph, so the search
+    code can use both: graph[(y, x)] -> [((y2, x2), 'E'), ...]
+    '''
+
+    def __init__(self, gridsize, cells, offsets, neighbors, dircodes, labels=None, costs=None):
+        self.gsy, self.gsx = (int(val) for val in gridsize)
+        self.cells = cells
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.dircodes = dircodes
+        self.labels = labels
+        self.costs = costs
+        # prepared costs of the searches (`astar_search.CostTable`)
+        self.cost_table = None
+
+    @classmethod
+    def from_links(cls, gridsize, nys, nxs, links):
+        '''Builds the CSR arrays from the output of `M2G.link_masks`.'''
+        gsx = gridsize[1]
+        cell_t = np.int32 if gridsize[0] * gsx < 2**31 else np.int64
+        cells = (nys.astype(np.int64) * gsx + nxs).astype(cell_t)
+        offsets = np.zeros(cells.size + 1, dtype=np.int64)
+        np.cumsum(links.sum(axis=0), out=offsets[1:])
+
+        # node-major order of the nonzero entries matches the offsets
+        src_i, dircodes = np.nonzero(links.T)
+        shift = np.array([d_y * gsx + d_x for _d_name, (d_y, d_x) in DIRS], dtype=np.int64)
+        dest_f = cells[src_i].astype(np.int64) + shift[dircodes]
+        neighbors = np.searchsorted(cells, dest_f).astype(np.int32)
+        return cls(gridsize, cells, offsets, neighbors, dircodes.astype(np.uint8))
+
+    @classmethod
+    def from_dict(cls, gridsize, graphdict):
+        '''Builds the CSR arrays from a graph dict of maze2graph.'''
+        nodes = sorted(graphdict)
+        nys = np.array([y_pos for y_pos, _x_pos in nodes], dtype=np.int64)
+        nxs = np.array([x_pos for _y_pos, x_pos in nodes], dtype=np.int64)
+        dir_idx = {d_name: idx for idx, d_name in enumerate(DIR_NAMES)}
+        links = np.zeros((len(DIRS), len(nodes)), dtype=bool)
+        for src_i, node in enumerate(nodes):
+            for _dest_n, d_name in graphdict[node]:
+                links[dir_idx[d_name], src_i] = True
+        return cls.from_links(gridsize, nys, nxs, links)
+
+    @property
+    def gridsize(self):
+        '''Size of the underlying grid as (y, x).'''
+        return self.gsy, self.gsx
+
+    @property
+    def keycount(self):
+        '''Number of nodes.'''
+        return int(self.cells.size)
+
+    @property
+    def valcount(self):
+        '''Number of (directed) links.'''
+        return int(self.neighbors.size)
+
+    def node_id(self, node):
+        '''Returns the integer id of a (y, x) node or None if not walkable.'''
+        y_pos, x_pos = node
+        if not (0 <= y_pos < self.gsy and 0 <= x_pos < self.gsx):
+            return None
+        flat = y_pos * self.gsx + x_pos
+        nid = int(np.searchsorted(self.cells, flat))
+        if nid < self.cells.size and self.cells[nid] == flat:
+            return nid
+        return None
+
+    def node_pos(self, nid):
+        '''Returns the (y, x) node of a integer id.'''
+        return divmod(int(self.cells[nid]), self.gsx)
+
+    def links(self, nid):
+        '''Returns the neighbor ids and direction codes of a node id.'''
+        beg, end = self.offsets[nid], self.offsets[nid + 1]
+        return self.neighbors[beg:end], self.dircodes[beg:end]
+
+    def __len__(self):
+        return self.keycount
+
+    def __contains__(self, node):
+        return self.node_id(node) is not None
+
+    def __iter__(self):
+        for flat in self.cells.tolist():
+            yield divmod(flat, self.gsx)
+
+    def __getitem__(self, node):
+        nid = self.node_id(node)
+        if nid is None:
+            raise KeyError(node)
+        nbrs, codes = self.links(nid)
+        gsx = self.gsx
+        return [(divmod(flat, gsx), DIR_NAMES[code])
+                for flat, code in zip(self.cells[nbrs].tolist(), codes.tolist())]
+
+    def to_dict(self):
+        '''Returns the graph in the dict format of maze2graph.'''
+        return {node: self[node] for node in self}
+
+    def save(self, filepath):
+        '''Stores the arrays in a (uncompressed) numpy `.npz` file.'''
+        arrays = {'gridsize': np.array(self.gridsize), 'cells': self.cells,
+                  'offsets': self.offsets, 'neighbors': self.neighbors,
+                  'dircodes': self.dircodes}
+        if self.labels is not None:
+            arrays['labels'] = self.labels
+        if self.costs is not None:
+            arrays['costs'] = self.costs
+        np.savez(filepath, **arrays)
+
+    def write(self, filepath):
+        '''Stores the graph in the self-describing binary graph file; see
+        `MAGIC` and `read`.'''
+        stored = [name for name in SECTIONS if getattr(self, name) is not None]
+        sections = create_graph_file(filepath, self.gridsize, self.keycount, self.valcount,
+                                     stored, self.cells.dtype.itemsize == 8)
+        for name, section in sections.items():
+            section[...] = getattr(self, name)
+            if isinstance(section, np.memmap):
+                section.flush()
+
+    @classmethod
+    def read(cls, filepath, mmap=True):
+        '''Opens a binary graph file. With `mmap` the arrays are read-only
+        memory maps, so the search can start before the file is read.'''
+        with open(filepath, 'rb') as ofi:
+            head = ofi.read(HEADER.size + SECTION_TABLE.size)
+        if len(head) < HEADER.size + SECTION_TABLE.size or head[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{filepath} is no graph file.")
+        _magic, version, flags, gsy, gsx, keycount, valcount = HEADER.unpack_from(head)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Graph file format version {version} is not supported (needs {FORMAT_VERSION}).")
+        table = dict(zip(SECTIONS, SECTION_TABLE.unpack_from(head, HEADER.size)))
+
+        arrays = {}
+        for name, (dtype, shape) in section_layout(flags, (gsy, gsx), keycount, valcount).items():
+            if not table[name]:
+                arrays[name] = None
+            elif not np.prod(shape):
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(filepath, dtype=dtype, mode='r', offset=table[name], shape=shape)
+            else:
+                arrays[name] = np.fromfile(filepath, dtype=dtype, count=int(np.prod(shape)),
+                                           offset=table[name]).reshape(shape)
+        return cls((gsy, gsx), *(arrays[name] for name in SECTIONS))
+
+    @classmethod
+    def load(cls, filepath):
+        '''Reads a graph stored with `save` back.'''
+        with np.load(filepath) as npz:
+            labels = npz['labels'] if 'labels' in npz.files else None
+            costs = npz['costs'] if 'costs' in npz.files else None
+            return cls(npz['gridsize'], npz['cells'], npz['offsets'],
+                       npz['neighbors'], npz['dircodes'], labels, costs)
+
+
+def section_layout(flags, gridsize, keycount, valcount):
+    '''Dtype and shape of every array section of a binary graph file.'''
+    return {'cells': ('<i8' if flags & FLAG_CELLS64 else '<i4', (keycount,)),
+            'offsets': ('<i8', (keycount + 1,)),
+            'neighbors': ('<i4', (valcount,)),
+            'dircodes': (np.uint8, (valcount,)),
+            'labels': ('<i4', tuple(gridsize)),
+            'costs': ('<f4', tuple(gridsize))}
+
+
+def create_graph_file(filepath, gridsize, keycount, valcount, stored, cells64=False):
+    '''
+    Writes header and section table of a binary graph file with the
+    sections named in `stored` and sizes the file. Returns writable memory
+    maps of the sections, so big graphs can be filled piece by piece
+    (see `maze2graph.bitmap2graph`).
+    '''
+    flags = FLAG_CELLS64 if cells64 else 0
+    layout = section_layout(flags, gridsize, keycount, valcount)
+    pos = -(-(HEADER.size + SECTION_TABLE.size) // ALIGN) * ALIGN
+    table = []
+    for name in SECTIONS:
+        if name not in stored:
+            table.append(0)
+            continue
+        table.append(pos)
+        dtype, shape = layout[name]
+        pos += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // ALIGN) * ALIGN
+    with open(filepath, 'wb') as nfi:
+        nfi.write(HEADER.pack(MAGIC, FORMAT_VERSION, flags, *gridsize, keycount, valcount))
+        nfi.write(SECTION_TABLE.pack(*table))
+        nfi.truncate(pos)
+
+    sections = {}
+    for name, offset in zip(SECTIONS, table):
+        if offset:
+            dtype, shape = layout[name]
+            sections[name] = (np.memmap(filepath, dtype=dtype, mode='r+', offset=offset, shape=shape)
+                              if np.prod(shape) else np.zeros(shape, dtype=dtype))
+    return sections
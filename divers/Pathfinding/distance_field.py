@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Distance fields: one multi-source Dijkstra run from a set of goal cells over
+the walkability matrix of a map. Afterwards every cell knows its distance to
+the nearest goal and the direction of its next step there (flow field), so
+any number of agents can move without a search of their own.
+'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+import sys
+from pathlib import Path
+import argparse
+from heapq import heappop, heappush
+from math import sqrt
+import numpy as np
+from csrgraph import DIRS
+
+__title__ = 'distance_field'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.1.0-alpha'
+
+INF = float('inf')
+# marks cells without a next step in `steps`: goals, unreached and unwalkable
+NO_STEP = -1
+
+
+class DistanceField:
+    '''
+    Multi-source Dijkstra over a matrix like `M2G.mtrx`, optional with the
+    terrain costs of `M2G.terrain_costs` (same move costs as A*).
+
+    `compute` fills three dense arrays over the grid:
+    dist    - float64 distance to the nearest goal; inf if not reachable
+    steps   - int8 index into `DIRS` of the next step to the nearest goal
+    origin  - int32 index of that goal in the given goal list; -1 if none
+    '''
+
+    def __init__(self, mtrx, costs=None):
+        self.gsy, self.gsx = mtrx.shape
+        self.costs = costs
+        self.dist = None
+        self.steps = None
+        self.origin = None
+        # flat index of the padded grid; the unwalkable border spares any
+        # range checks in the hot loop
+        self.width = self.gsx + 2
+        self.walk = np.pad(mtrx != 0, 1).ravel().tolist()
+
+    def compute(self, goals, max_dist=None):
+        '''Runs the search from all goal cells at once; unwalkable goals are
+        skipped, cells farther away than `max_dist` are left unreached.
+        Returns dist and steps.'''
+
+        width = self.width
+        walk = self.walk
+        shifts = [d_y * width + d_x for _d_name, (d_y, d_x) in DIRS]
+        lengths = [sqrt(2) if d_y and d_x else 1.0 for _d_name, (d_y, d_x) in DIRS]
+        # the step to the neighbor in direction `idx` leads back with `rev[idx]`
+        rev = [[r_y, r_x] for _r_name, (r_y, r_x) in DIRS]
+        rev = [rev.index([-d_y, -d_x]) for _d_name, (d_y, d_x) in DIRS]
+        cell_cost = None
+        if self.costs is not None:
+            cell_cost = np.pad(np.asarray(self.costs, dtype=np.float64), 1).ravel().tolist()
+        limit = INF if max_dist is None else max_dist
+
+        size = len(walk)
+        dist = [INF] * size
+        steps = [NO_STEP] * size
+        origin = [-1] * size
+        frontier = []
+        for idx, (y_pos, x_pos) in enumerate(goals):
+            if not (0 <= y_pos < self.gsy and 0 <= x_pos < self.gsx):
+                raise ValueError(f"Goal {(y_pos, x_pos)} lies outside the grid.")
+            flat = (y_pos + 1) * width + x_pos + 1
+            if walk[flat] and dist[flat] > 0:
+                dist[flat] = 0.0
+                origin[flat] = idx
+                frontier.append((0.0, flat))
+
+        while frontier:
+            cur_dist, current = heappop(frontier)
+            if cur_dist > dist[current]:
+                # stale entry; the cell was settled with a smaller distance
+                continue
+            cur_origin = origin[current]
+            for idx, shift in enumerate(shifts):
+                nxt = current + shift
+                if not walk[nxt]:
+                    continue
+                if cell_cost is None:
+                    new_dist = cur_dist + lengths[idx]
+                else:
+                    new_dist = cur_dist + lengths[idx] * 0.5 * (cell_cost[current] + cell_cost[nxt])
+                if new_dist < dist[nxt] and new_dist <= limit:
+                    dist[nxt] = new_dist
+                    steps[nxt] = rev[idx]
+                    origin[nxt] = cur_origin
+                    heappush(frontier, (new_dist, nxt))
+
+        shape = (self.gsy + 2, self.gsx + 2)
+        self.dist = np.array(dist).reshape(shape)[1:-1, 1:-1]
+        self.steps = np.array(steps, dtype=np.int8).reshape(shape)[1:-1, 1:-1]
+        self.origin = np.array(origin, dtype=np.int32).reshape(shape)[1:-1, 1:-1]
+        return self.dist, self.steps
+
+    def next_step(self, node):
+        '''The neighbor cell to move to from a cell; None at a goal or if no
+        goal is reachable. O(1) array lookup.'''
+        code = self.steps[node]
+        if code == NO_STEP:
+            return None
+        d_y, d_x = DIRS[code][1]
+        return node[0] + d_y, node[1] + d_x
+
+    def path(self, node):
+        '''Follows the steps from a cell to its nearest goal. Returns the
+        pathway like A* does or a empty list if no goal is reachable.'''
+        if self.dist[node] == INF:
+            return []
+        pathway = [node]
+        nxt_node = self.next_step(node)
+        while nxt_node is not None:
+            pathway.append(nxt_node)
+            nxt_node = self.next_step(nxt_node)
+        return pathway
+
+    def nearest(self, node):
+        '''Index of the nearest goal of a cell in the goal list; -1 if none
+        is reachable.'''
+        return int(self.origin[node])
+
+
+def get_args():
+    '''Parses function: Takes the mask image and the goal cells in.'''
+
+    def valid_file(infilename):
+        '''Helper to test the given string for the infilename.'''
+
+        if not Path(infilename).is_file():
+            raise parser.error('Input file not found.')
+        return infilename
+
+    def cell(inp):
+        '''Help function to read a cell like `12,40` in.'''
+        try:
+            y_pos, x_pos = (int(val) for val in inp.split(','))
+        except ValueError:
+            raise parser.error(f'{inp} is no valid cell (y,x).')
+        return y_pos, x_pos
+
+    parser = argparse.ArgumentParser(description='Computes the distance field to a set of goal cells of a mask image.')
+    parser.add_argument('img_file', action='store', type=valid_file,
+                        metavar='Image file',
+                        help='Mask image to use.')
+    parser.add_argument('goals', type=cell, nargs='+', metavar='y,x',
+                        help='Goal cells.')
+    parser.add_argument('--max-dist', type=float, help='Stop the field at this distance.')
+    return parser.parse_args()
+
+
+def main(cfg):
+    '''...main function.'''
+
+    from maze2graph import M2G
+    mtrx = M2G(cfg.img_file).mtrx
+    dfield = DistanceField(mtrx)
+    dist, steps = dfield.compute(cfg.goals, cfg.max_dist)
+
+    if not Path('graphdata').exists():
+        Path('graphdata').mkdir(parents=True, exist_ok=True)
+    np.savez('graphdata/distfield.npz', dist=dist, steps=steps, origin=dfield.origin)
+
+
+if __name__ == '__main__':
+    if not sys.version_info >= (3, 6):
+        raise ValueError("Python 3.6 or higher needet.")
+    main(get_args())
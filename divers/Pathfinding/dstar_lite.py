@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+D* Lite (Koenig & Likhachev) replanner on the walkability matrix of a map.
+The search runs from the goal back to the agent and keeps its state between
+calls; after a change of walkability or edge costs only the affected nodes
+are processed again instead of a new search from scratch.
+'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+import sys
+from pathlib import Path
+import argparse
+from heapq import heappop, heappush
+from astar_search import GridPathSearch, save_path
+
+__title__ = 'dstar_lite'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.1.0-alpha'
+
+INF = float('inf')
+# relative tolerance of the key comparison; sums of the octile heuristic
+# differ in the last bits for equal keys
+KEY_EPS = 1e-9
+
+
+def key_less(k_a, k_b):
+    '''Compares two keys (primary, secondary) with tolerance; near-ties are
+    not "less".'''
+    for val_a, val_b in zip(k_a, k_b):
+        tol = KEY_EPS * max(1.0, abs(val_b)) if val_b != INF else 0
+        if val_a < val_b - tol:
+            return True
+        if val_a > val_b + tol:
+            return False
+    return False
+
+
+class DStarLite(GridPathSearch):
+    '''
+    Incremental replanner with the interface of `GridPathSearch`:
+    `a_star_pathsearch` returns the current pathway and the g-values.
+
+    Between two calls the agent can move on (`move_start`), cells can change
+    (`update_cells`, `update_box`) and single links can get other costs
+    (`update_edge`); the next call repairs the path.
+    '''
+
+    def __init__(self, mtrx, start, goal):
+        super().__init__(mtrx, start, goal)
+        # mutable rows, the walkability changes with `update_cells`
+        self.walk = [bytearray(row) for row in self.walk]
+        self.edge_cost = {}
+        self.g_val = {}
+        self.rhs = {goal: 0}
+        self.queue = []
+        self.queued = {}
+        self.k_m = 0
+        self.last_start = start
+        self.expanded = 0
+        self.push(goal, (self.heuristic(start, goal), 0))
+
+    def cost(self, src, dst):
+        '''Cost of the link between two neighbor cells; INF if one of them is
+        unwalkable.'''
+        if not self.walk[src[0] + 1][src[1] + 1] or not self.walk[dst[0] + 1][dst[1] + 1]:
+            return INF
+        return self.edge_cost.get((src, dst), self.heuristic(src, dst))
+
+    def calc_key(self, node):
+        '''Priority of a node; the heuristic is taken to the (moving) start.'''
+        best = min(self.g_val.get(node, INF), self.rhs.get(node, INF))
+        return best + self.heuristic(self.start, node) + self.k_m, best
+
+    def push(self, node, key):
+        '''Puts a node with a key in the queue; older entries become stale.'''
+        self.queued[node] = key
+        heappush(self.queue, (key, node))
+
+    def top_key(self):
+        '''Returns the smallest valid key; drops stale heap entries.'''
+        while self.queue:
+            key, node = self.queue[0]
+            if self.queued.get(node) == key:
+                return key
+            heappop(self.queue)
+        return INF, INF
+
+    def update_vertex(self, node):
+        '''Recomputes the rhs-value of a node and its queue membership.'''
+        if node != self.goal:
+            self.rhs[node] = min((self.cost(node, nbr) + self.g_val.get(nbr, INF)
+                                  for nbr, _d_name in self.neighbors(node)), default=INF)
+        self.queued.pop(node, None)
+        if self.g_val.get(node, INF) != self.rhs.get(node, INF):
+            self.push(node, self.calc_key(node))
+
+    def compute_shortest_path(self):
+        '''Processes the queue until the start is consistent. A top key which
+        only differs by rounding from the one of the start is processed too;
+        stopping there can leave nodes on the path inconsistent.'''
+        while not key_less(self.calc_key(self.start), self.top_key()) \
+                or self.rhs.get(self.start, INF) != self.g_val.get(self.start, INF):
+            if not self.queue:
+                break
+            k_old, node = heappop(self.queue)
+            del self.queued[node]
+            self.expanded += 1
+            k_new = self.calc_key(node)
+            if key_less(k_old, k_new):
+                self.push(node, k_new)
+            elif self.g_val.get(node, INF) > self.rhs.get(node, INF):
+                self.g_val[node] = self.rhs[node]
+                for nbr, _d_name in self.neighbors(node):
+                    self.update_vertex(nbr)
+            else:
+                self.g_val[node] = INF
+                self.update_vertex(node)
+                for nbr, _d_name in self.neighbors(node):
+                    self.update_vertex(nbr)
+
+    def move_start(self, node):
+        '''The agent moved on; the old keys stay valid through `k_m`.'''
+        self.k_m += self.heuristic(self.last_start, node)
+        self.last_start = node
+        self.start = node
+
+    def cell_nbrs(self, node):
+        '''All neighbor cells inside the grid, walkable or not.'''
+        y_pos, x_pos = node
+        return [(y_pos + d_y, x_pos + d_x) for d_y in (-1, 0, 1) for d_x in (-1, 0, 1)
+                if (d_y or d_x) and 0 <= y_pos + d_y < self.gsy and 0 <= x_pos + d_x < self.gsx]
+
+    def update_cells(self, cells, walkable):
+        '''Sets the walkability of cells; the cells and their neighbors are
+        updated for the next repair.'''
+        touched = set()
+        for y_pos, x_pos in cells:
+            self.walk[y_pos + 1][x_pos + 1] = 1 if walkable else 0
+            touched.add((y_pos, x_pos))
+            touched.update(self.cell_nbrs((y_pos, x_pos)))
+        for node in touched:
+            self.update_vertex(node)
+
+    def update_box(self, mtrx, box):
+        '''Takes the walkability of a box (y_min, y_max, x_min, x_max) from
+        a changed matrix; usable as `M2G.patch_hooks` entry via a lambda.'''
+        y_min, y_max, x_min, x_max = box
+        for walkable in (True, False):
+            cells = [(y_pos, x_pos) for y_pos in range(y_min, y_max) for x_pos in range(x_min, x_max)
+                     if (mtrx[y_pos, x_pos] != 0) == walkable]
+            self.update_cells(cells, walkable)
+
+    def update_edge(self, src, dst, cost):
+        '''Sets the cost of the link between two neighbor cells (both ways).
+        Lower costs than the step length would break the heuristic.'''
+        if cost < self.heuristic(src, dst):
+            raise ValueError("Edge costs below the step length are not allowed.")
+        self.edge_cost[(src, dst)] = cost
+        self.edge_cost[(dst, src)] = cost
+        self.update_vertex(src)
+        self.update_vertex(dst)
+
+    def reconstruct_path(self):
+        '''Follows the cheapest links from the start to the goal. Gives up
+        with a empty pathway if a node comes again (inconsistent g-values),
+        instead of running in circles.'''
+        self.pathway = []
+        if self.g_val.get(self.start, INF) == INF:
+            return
+        cur_node = self.start
+        self.pathway.append(cur_node)
+        visited = {cur_node}
+        while cur_node != self.goal:
+            cur_node = min(self.neighbors(cur_node),
+                           key=lambda nbr: self.cost(cur_node, nbr[0]) + self.g_val.get(nbr[0], INF))[0]
+            if cur_node in visited or len(self.pathway) > self.gsy * self.gsx:
+                self.pathway = []
+                return
+            visited.add(cur_node)
+            self.pathway.append(cur_node)
+
+    def a_star_pathsearch(self):
+        '''Plans or repairs the path from the current start to the goal.'''
+        self.compute_shortest_path()
+        self.reconstruct_path()
+        return self.pathway, self.g_val
+
+
+def get_args():
+    '''Parses function: Takes the mask image in and validates her.'''
+
+    def valid_file(infilename):
+        '''Helper to test the given string for the infilename.'''
+
+        if not Path(infilename).is_file():
+            raise parser.error('Input file not found.')
+        return infilename
+
+    parser = argparse.ArgumentParser(description='Finds path from a source point to a target with D* Lite on a mask image.')
+    parser.add_argument('img_file', action='store', type=valid_file,
+                        metavar='Image file',
+                        help='Mask image to search.')
+    return parser.parse_args()
+
+
+def main(cfg):
+    '''...main function.'''
+
+    from maze2graph import M2G
+    mtrx = M2G(cfg.img_file).mtrx
+    start, goal = (1, 1), (mtrx.shape[0] - 2, mtrx.shape[1] - 2)
+    dsl = DStarLite(mtrx, start, goal)
+
+    found_path, _cost = dsl.a_star_pathsearch()
+    save_path(found_path)
+
+
+if __name__ == '__main__':
+    if not sys.version_info >= (3, 6):
+        raise ValueError("Python 3.6 or higher needet.")
+    main(get_args())
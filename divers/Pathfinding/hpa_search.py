@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Hierarchical pathfinding (HPA*) over the walkability matrix of a map. The grid
+is cut into square clusters; entrances on the cluster borders and the costs
+between them are computed once. A query plans on this small abstract graph
+and refines only the chosen cluster crossings with local A* runs.
+'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+import sys
+from pathlib import Path
+import argparse
+from heapq import heappop, heappush
+from math import sqrt
+import numpy as np
+from astar_search import GraphPathSearch, GridPathSearch, save_path
+from csrgraph import DIRS
+
+# (y change, x change, step cost) of the eight moves
+STEPS = tuple((d_y, d_x, sqrt(2) if d_y and d_x else 1.0) for _d_name, (d_y, d_x) in DIRS)
+
+__title__ = 'hpa_search'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.2.0-alpha'
+
+
+class BoundedGridSearch(GridPathSearch):
+    '''A* on a already padded walk matrix, restricted to a box of cells
+    (y_min, y_max, x_min, x_max); the max values are exclusive.'''
+
+    def __init__(self, walk, bounds, start, goal):
+        GraphPathSearch.__init__(self, None, start, goal)
+        self.walk = walk
+        self.bounds = bounds
+
+    def neighbors(self, node):
+        '''Returns the walkable neighbors of a cell inside the bounds.'''
+        y_min, y_max, x_min, x_max = self.bounds
+        return [(nbr, d_name) for nbr, d_name in super().neighbors(node)
+                if y_min <= nbr[0] < y_max and x_min <= nbr[1] < x_max]
+
+    def local_costs(self, targets):
+        '''Dijkstra from `start`; returns the costs to the reached targets.'''
+        targets = set(targets)
+        found = {}
+        frontier = [(0, self.start)]
+        cur_cost = {self.start: 0}
+        while frontier and len(found) < len(targets):
+            cost, current = heappop(frontier)
+            if cost > cur_cost[current]:
+                continue
+            if current in targets:
+                found[current] = cost
+            for nxt_node, _node_dir in self.neighbors(current):
+                new_cost = cost + self.heuristic(current, nxt_node)
+                if nxt_node not in cur_cost or new_cost < cur_cost[nxt_node]:
+                    cur_cost[nxt_node] = new_cost
+                    heappush(frontier, (new_cost, nxt_node))
+        return found
+
+
+class ClusterGraph:
+    '''
+    Abstract graph of the HPA* layer, built from `M2G.mtrx`.
+
+    cluster_size   - edge length of the square clusters
+    entrance_split - a walkable border run shorter than this gets one
+                     entrance in the middle, a longer one two at its ends.
+
+    Both are the quality/latency knobs: more entrances (small split) or
+    smaller clusters give paths closer to the optimum, but a bigger
+    abstract graph and slower queries. The paths are complete, but not
+    always optimal; the detours happen mostly on short queries.
+    '''
+
+    def __init__(self, mtrx, cluster_size=32, entrance_split=6):
+        self.gsy, self.gsx = mtrx.shape
+        self.csize = cluster_size
+        self.split = entrance_split
+        self.mtrx = mtrx != 0
+        self.walk = GridPathSearch(mtrx, None, None).walk
+        # cluster (cy, cx) -> entrance nodes; node -> {node: cost}
+        self.entrances = {}
+        self.edges = {}
+        # border (line, lo_end, hi_end, vertical) -> its entrance pairs
+        self.borders = {}
+        self.build()
+
+    def is_walkable(self, y_pos, x_pos):
+        '''Checks a cell; off grid cells count as unwalkable.'''
+        return bool(self.walk[y_pos + 1][x_pos + 1])
+
+    def cluster(self, node):
+        '''Returns the cluster coordinate of a cell.'''
+        return node[0] // self.csize, node[1] // self.csize
+
+    def bounds(self, clst):
+        '''Returns the cell box of a cluster as (y_min, y_max, x_min, x_max).'''
+        c_y, c_x = clst
+        return (c_y * self.csize, min((c_y + 1) * self.csize, self.gsy),
+                c_x * self.csize, min((c_x + 1) * self.csize, self.gsx))
+
+    def cluster_borders(self, clst):
+        '''Returns the keys of the (up to four) borders of a cluster.'''
+        y_min, y_max, x_min, x_max = self.bounds(clst)
+        keys = []
+        for line, lo_end, hi_end, vertical, inside in (
+                (x_min, y_min, y_max, True, x_min > 0), (x_max, y_min, y_max, True, x_max < self.gsx),
+                (y_min, x_min, x_max, False, y_min > 0), (y_max, x_min, x_max, False, y_max < self.gsy)):
+            if inside:
+                keys.append((line, lo_end, hi_end, vertical))
+        return keys
+
+    def add_entrance(self, node_a, node_b, cost, key):
+        '''Adds a pair of linked border cells as inter cluster edge.'''
+        self.borders.setdefault(key, []).append((node_a, node_b))
+        for src, dst in ((node_a, node_b), (node_b, node_a)):
+            self.entrances.setdefault(self.cluster(src), set()).add(src)
+            self.edges.setdefault(src, {})[dst] = cost
+
+    def border_runs(self, line, lo_end, hi_end, vertical):
+        '''Finds the entrances on one border. The border lies between the
+        cells `line - 1` and `line` (columns if vertical, else rows) and
+        spans the cells lo_end to hi_end of the other axis.'''
+
+        def cell(pos, side):
+            return (pos, side) if vertical else (side, pos)
+
+        key = (line, lo_end, hi_end, vertical)
+        run = []
+        for pos in range(lo_end, hi_end + 1):
+            if pos < hi_end and self.is_walkable(*cell(pos, line - 1)) \
+                    and self.is_walkable(*cell(pos, line)):
+                run.append(pos)
+                continue
+            if run:
+                ends = (run[len(run) // 2],) if len(run) < self.split else (run[0], run[-1])
+                for r_pos in ends:
+                    self.add_entrance(cell(r_pos, line - 1), cell(r_pos, line), 1, key)
+                run = []
+
+        # a diagonal link across the border needs a own entrance only if
+        # both cells beside it are blocked (else a orthogonal run covers it)
+        for pos in range(lo_end, hi_end):
+            for a_pos, b_pos in ((pos, pos + 1), (pos + 1, pos)):
+                node_a, node_b = cell(a_pos, line - 1), cell(b_pos, line)
+                if self.is_walkable(*node_a) and self.is_walkable(*node_b) \
+                        and not self.is_walkable(*cell(b_pos, line - 1)) \
+                        and not self.is_walkable(*cell(a_pos, line)):
+                    self.add_entrance(node_a, node_b, GraphPathSearch.heuristic(node_a, node_b), key)
+
+    def build(self):
+        '''Finds all entrances and the costs between the entrances of each
+        cluster.'''
+        for line in range(self.csize, self.gsx, self.csize):
+            for lo_end in range(0, self.gsy, self.csize):
+                self.border_runs(line, lo_end, min(lo_end + self.csize, self.gsy), True)
+        for line in range(self.csize, self.gsy, self.csize):
+            for lo_end in range(0, self.gsx, self.csize):
+                self.border_runs(line, lo_end, min(lo_end + self.csize, self.gsx), False)
+
+        for clst in self.entrances:
+            self.intra_costs(clst)
+
+    def intra_costs(self, clst):
+        '''Computes the costs between all entrances of a cluster. The
+        walkable cells of the cluster get local ids and a neighbor list
+        once; then one Dijkstra per entrance runs until all entrances of the
+        cluster are settled.'''
+        y_min, y_max, x_min, x_max = self.bounds(clst)
+        nys, nxs = np.nonzero(self.mtrx[y_min:y_max, x_min:x_max])
+        cells = list(zip((nys + y_min).tolist(), (nxs + x_min).tolist()))
+        index = {cell: idx for idx, cell in enumerate(cells)}
+        adjacency = [[(index[(y_pos + d_y, x_pos + d_x)], step) for d_y, d_x, step in STEPS
+                      if (y_pos + d_y, x_pos + d_x) in index]
+                     for y_pos, x_pos in cells]
+
+        ents = [index[node] for node in self.entrances[clst]]
+        for src in ents:
+            targets = set(ents)
+            dist = {src: 0}
+            frontier = [(0, src)]
+            while frontier and targets:
+                cost, current = heappop(frontier)
+                if cost > dist[current]:
+                    continue
+                targets.discard(current)
+                for nxt, step in adjacency[current]:
+                    new_cost = cost + step
+                    if nxt not in dist or new_cost < dist[nxt]:
+                        dist[nxt] = new_cost
+                        heappush(frontier, (new_cost, nxt))
+            for dst in ents:
+                if dst != src and dst in dist:
+                    self.edges[cells[src]][cells[dst]] = dist[dst]
+
+    def update(self, m2g, box):
+        '''Brings the abstract graph in line with a patched `M2G`; usable as
+        `M2G.patch_hooks` entry, which get called with (m2g, box). Only the
+        borders and entrance costs of the clusters around the touched box
+        (y_min, y_max, x_min, x_max) get rebuild.'''
+        y_min, y_max, x_min, x_max = box
+        self.mtrx[y_min:y_max, x_min:x_max] = m2g.mtrx[y_min:y_max, x_min:x_max] != 0
+        for y_pos in range(y_min, y_max):
+            self.walk[y_pos + 1] = bytes(np.pad(self.mtrx[y_pos], 1).astype(np.uint8))
+
+        # the border scans look one cell beyond a cluster
+        csz = self.csize
+        touched = {(c_y, c_x)
+                   for c_y in range(max(y_min - 1, 0) // csz, min(y_max, self.gsy - 1) // csz + 1)
+                   for c_x in range(max(x_min - 1, 0) // csz, min(x_max, self.gsx - 1) // csz + 1)}
+        keys = {key for clst in touched for key in self.cluster_borders(clst)}
+
+        redo = set(touched)
+        for key in keys:
+            for node_a, node_b in self.borders.pop(key, ()):
+                self.edges.get(node_a, {}).pop(node_b, None)
+                self.edges.get(node_b, {}).pop(node_a, None)
+                redo.update((self.cluster(node_a), self.cluster(node_b)))
+        for key in keys:
+            self.border_runs(*key)
+            for node_a, node_b in self.borders.get(key, ()):
+                redo.update((self.cluster(node_a), self.cluster(node_b)))
+
+        # drop the old intra edges; entrances without a inter edge are gone
+        for clst in redo:
+            entrances = set()
+            for node in self.entrances.pop(clst, ()):
+                links = self.edges.get(node, {})
+                for dst in [dst for dst in links if self.cluster(dst) == clst]:
+                    del links[dst]
+                if links:
+                    entrances.add(node)
+                else:
+                    self.edges.pop(node, None)
+            if entrances:
+                self.entrances[clst] = entrances
+        for clst in redo:
+            if clst in self.entrances:
+                self.intra_costs(clst)
+
+    def connect(self, src, clst, targets):
+        '''Returns the costs from a cell to the reachable targets inside its
+        cluster.'''
+        return BoundedGridSearch(self.walk, self.bounds(clst), src, None).local_costs(targets)
+
+
+class HierarchicalPathSearch(GraphPathSearch):
+    '''Path search over a `ClusterGraph`: start and goal are linked to the
+    entrances of their clusters, A* runs on the abstract graph and every
+    step inside a cluster is refined with a local A*.'''
+
+    def __init__(self, clgraph, start, goal, labels=None):
+        super().__init__(None, start, goal, labels)
+        self.clgraph = clgraph
+        self.temp_edges = {}
+        self.waypoints = []
+
+    def neighbors(self, node):
+        '''Abstract neighbors of a node with their costs.'''
+        edges = self.clgraph.edges.get(node, {})
+        temp = self.temp_edges.get(node)
+        if temp:
+            edges = {**edges, **temp}
+        return edges.items()
+
+    def insert_endpoints(self):
+        '''Links start and goal temporary to the entrances of their cluster
+        (and to each other if they share one).'''
+        clg = self.clgraph
+        for node in (self.start, self.goal):
+            clst = clg.cluster(node)
+            targets = set(clg.entrances.get(clst, ()))
+            if clg.cluster(self.start) == clg.cluster(self.goal):
+                targets.add(self.goal if node == self.start else self.start)
+            for dst, cost in clg.connect(node, clst, targets).items():
+                if dst != node:
+                    self.temp_edges.setdefault(node, {})[dst] = cost
+                    self.temp_edges.setdefault(dst, {})[node] = cost
+
+    def refine(self):
+        '''Turns the abstract waypoints into a cell by cell pathway.'''
+        clg = self.clgraph
+        self.pathway = [self.start]
+        for src, dst in zip(self.waypoints, self.waypoints[1:]):
+            if clg.cluster(src) != clg.cluster(dst):
+                # inter cluster edges link neighbor cells
+                self.pathway.append(dst)
+                continue
+            local = BoundedGridSearch(clg.walk, clg.bounds(clg.cluster(src)), src, dst)
+            self.pathway.extend(local.a_star_pathsearch()[0][1:])
+
+    def a_star_pathsearch(self, refine=True):
+        '''Abstract A* plus refinement. Returns the pathway (or only the
+        abstract waypoints if `refine` is False) and the abstract costs.'''
+
+        if not self.reachable():
+            return self.pathway, {}
+        self.insert_endpoints()
+
+        frontier = []
+        heappush(frontier, (0, self.start))
+        self.explored = {self.start: None}
+        cur_cost = {self.start: 0}
+        closed = set()
+
+        while frontier:
+            current = heappop(frontier)[1]
+            if current == self.goal:
+                break
+            if current in closed:
+                continue
+            closed.add(current)
+
+            for nxt_node, step in self.neighbors(current):
+                new_cost = cur_cost[current] + step
+                if nxt_node not in cur_cost or new_cost < cur_cost[nxt_node]:
+                    cur_cost[nxt_node] = new_cost
+                    priority = new_cost + self.heuristic(nxt_node, self.goal)
+                    heappush(frontier, (priority, nxt_node))
+                    self.explored[nxt_node] = current
+
+        if self.goal not in self.explored:
+            return self.pathway, cur_cost
+        GraphPathSearch.reconstruct_path(self)
+        self.waypoints = self.pathway
+        if not refine:
+            return self.waypoints, cur_cost
+        self.refine()
+        return self.pathway, cur_cost
+
+
+def get_args():
+    '''Parses function: Takes the mask image in and validates her.'''
+
+    def valid_file(infilename):
+        '''Helper to test the given string for the infilename.'''
+
+        if not Path(infilename).is_file():
+            raise parser.error('Input file not found.')
+        return infilename
+
+    parser = argparse.ArgumentParser(description='Finds path from a source point to a target with hierarchical A* on a mask image.')
+    parser.add_argument('img_file', action='store', type=valid_file,
+                        metavar='Image file',
+                        help='Mask image to search.')
+    parser.add_argument('-c', type=int, default=32, dest='csize',
+                        help='Cluster size; smaller gives better paths but slower queries. default:32')
+    return parser.parse_args()
+
+
+def main(cfg):
+    '''...main function.'''
+
+    from maze2graph import M2G
+    m2g = M2G(cfg.img_file)
+    mtrx = m2g.mtrx
+    clgraph = ClusterGraph(mtrx, cfg.csize)
+    start, goal = (1, 1), (mtrx.shape[0] - 2, mtrx.shape[1] - 2)
+    hps = HierarchicalPathSearch(clgraph, start, goal, m2g.label_components())
+
+    found_path, _cost = hps.a_star_pathsearch()
+    save_path(found_path)
+
+
+if __name__ == '__main__':
+    if not sys.version_info >= (3, 6):
+        raise ValueError("Python 3.6 or higher needet.")
+    main(get_args())
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''Jump Point Search (Harabor & Grastien) on the walkability matrix of a map.
+Finds paths with the same costs as A* on a uniform cost 8-connected grid, but
+puts only the jump points on the heap instead of every cell.'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+import sys
+from pathlib import Path
+import argparse
+from heapq import heappop, heappush
+from astar_search import GridPathSearch, save_path
+
+__title__ = 'jps_search'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.2.0-alpha'
+
+ALL_DIRS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+class JumpPointSearch(GridPathSearch):
+    '''JPS engine; a drop-in for `GridPathSearch.a_star_pathsearch`.
+
+    Diagonal moves are allowed like in the graph of maze2graph, i.e. also
+    past blocked corners. The pathway is returned cell by cell as by A*.'''
+
+    def __init__(self, mtrx, start, goal, labels=None):
+        super().__init__(mtrx, start, goal, labels)
+        self.expanded = 0
+
+    def blocked(self, y_pos, x_pos):
+        '''Checks if a cell is unwalkable or off the grid.'''
+        return not self.walk[y_pos + 1][x_pos + 1]
+
+    def jump(self, y_pos, x_pos, d_y, d_x):
+        '''Moves from a cell in one direction until a jump point (goal,
+        forced neighbor or a jump point in a straight sub direction) is
+        found and returns it. None if a obstacle comes first.'''
+        walk = self.walk
+        goal = self.goal
+        while True:
+            y_pos += d_y
+            x_pos += d_x
+            # padded matrix: cell (y, x) is walk[y + 1][x + 1]
+            w_y, w_x = y_pos + 1, x_pos + 1
+            if not walk[w_y][w_x]:
+                return None
+            if (y_pos, x_pos) == goal:
+                return y_pos, x_pos
+
+            if d_y and d_x:
+                if (not walk[w_y][w_x - d_x] and walk[w_y + d_y][w_x - d_x]) \
+                        or (not walk[w_y - d_y][w_x] and walk[w_y - d_y][w_x + d_x]):
+                    return y_pos, x_pos
+                if self.jump(y_pos, x_pos, d_y, 0) or self.jump(y_pos, x_pos, 0, d_x):
+                    return y_pos, x_pos
+            elif d_x:
+                if (not walk[w_y + 1][w_x] and walk[w_y + 1][w_x + d_x]) \
+                        or (not walk[w_y - 1][w_x] and walk[w_y - 1][w_x + d_x]):
+                    return y_pos, x_pos
+            else:
+                if (not walk[w_y][w_x + 1] and walk[w_y + d_y][w_x + 1]) \
+                        or (not walk[w_y][w_x - 1] and walk[w_y + d_y][w_x - 1]):
+                    return y_pos, x_pos
+
+    def prune_dirs(self, node, parent):
+        '''Returns the directions to follow from a node; the natural ones of
+        the arrival direction plus the forced ones.'''
+        if parent is None:
+            return ALL_DIRS
+
+        y_pos, x_pos = node
+        d_y = (y_pos > parent[0]) - (y_pos < parent[0])
+        d_x = (x_pos > parent[1]) - (x_pos < parent[1])
+        if d_y and d_x:
+            dirs = [(d_y, 0), (0, d_x), (d_y, d_x)]
+            if self.blocked(y_pos, x_pos - d_x):
+                dirs.append((d_y, -d_x))
+            if self.blocked(y_pos - d_y, x_pos):
+                dirs.append((-d_y, d_x))
+        elif d_x:
+            dirs = [(0, d_x)]
+            if self.blocked(y_pos + 1, x_pos):
+                dirs.append((1, d_x))
+            if self.blocked(y_pos - 1, x_pos):
+                dirs.append((-1, d_x))
+        else:
+            dirs = [(d_y, 0)]
+            if self.blocked(y_pos, x_pos + 1):
+                dirs.append((d_y, 1))
+            if self.blocked(y_pos, x_pos - 1):
+                dirs.append((d_y, -1))
+        return dirs
+
+    def reconstruct_path(self):
+        '''Rebuilds the pathway from the jump points and fills in the cells
+        between two of them, so it looks like a A* pathway.'''
+
+        if self.goal not in self.explored:
+            return
+        jump_pts = []
+        cur_node = self.goal
+        while cur_node is not None:
+            jump_pts.append(cur_node)
+            cur_node = self.explored[cur_node]
+        jump_pts.reverse()
+
+        self.pathway = [self.start]
+        for (y_pos, x_pos), (t_y, t_x) in zip(jump_pts, jump_pts[1:]):
+            d_y = (t_y > y_pos) - (t_y < y_pos)
+            d_x = (t_x > x_pos) - (t_x < x_pos)
+            while (y_pos, x_pos) != (t_y, t_x):
+                y_pos += d_y
+                x_pos += d_x
+                self.pathway.append((y_pos, x_pos))
+
+    def a_star_pathsearch(self):
+        '''A* over the jump points. Returns the pathway and the costs of the
+        expanded jump points.'''
+
+        if not self.reachable():
+            return self.pathway, {}
+
+        frontier = []
+        heappush(frontier, (0, self.start))
+        self.explored = {self.start: None}
+        cur_cost = {self.start: 0}
+        closed = set()
+        self.expanded = 0
+
+        while frontier:
+            current = heappop(frontier)[1]
+            if current == self.goal:
+                break
+            if current in closed:
+                continue
+            closed.add(current)
+            self.expanded += 1
+
+            for d_y, d_x in self.prune_dirs(current, self.explored[current]):
+                nxt_node = self.jump(current[0], current[1], d_y, d_x)
+                if nxt_node is None:
+                    continue
+                new_cost = cur_cost[current] + self.heuristic(current, nxt_node)
+                if nxt_node not in cur_cost or new_cost < cur_cost[nxt_node]:
+                    cur_cost[nxt_node] = new_cost
+                    priority = new_cost + self.heuristic(nxt_node, self.goal)
+                    heappush(frontier, (priority, nxt_node))
+                    self.explored[nxt_node] = current
+
+        self.reconstruct_path()
+        return self.pathway, cur_cost
+
+
+def get_args():
+    '''Parses function: Takes the mask image in and validates her.'''
+
+    def valid_file(infilename):
+        '''Helper to test the given string for the infilename.'''
+
+        if not Path(infilename).is_file():
+            raise parser.error('Input file not found.')
+        return infilename
+
+    parser = argparse.ArgumentParser(description='Finds path from a source point to a target with Jump Point Search on a mask image.')
+    parser.add_argument('img_file', action='store', type=valid_file,
+                        metavar='Image file',
+                        help='Mask image to search.')
+    return parser.parse_args()
+
+
+def main(cfg):
+    '''...main function.'''
+
+    from maze2graph import M2G
+    m2g = M2G(cfg.img_file)
+    mtrx = m2g.mtrx
+    start, goal = (1, 1), (mtrx.shape[0] - 2, mtrx.shape[1] - 2)
+    jps = JumpPointSearch(mtrx, start, goal, m2g.label_components())
+
+    found_path, _cost = jps.a_star_pathsearch()
+    save_path(found_path)
+
+
+if __name__ == '__main__':
+    if not sys.version_info >= (3, 6):
+        raise ValueError("Python 3.6 or higher needet.")
+    main(get_args())
@@ -9,53 +9,382 @@ constructs from it a graph representation of the the walkable area.
 
 
 import argparse
-import pprint
+import multiprocessing as mp
 import sys
+from itertools import islice
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
-from textwrap import dedent
 import numpy as np
 from PIL import Image
-import dill as pickle
+from csrgraph import DIRS, REV_DIRS, CsrGraph, create_graph_file
 
 __title__ = 'maze2graph'
 __license__ = 'MIT'
 __author__ = 'madeddy'
 __status__ = 'Development'
-__version__ = '0.22.0-alpha'
-
-
-def control(mtrx_arr, graphdict):
-    '''Control: Maze array and graph printed in txt files for easy checking.'''
+__version__ = '0.31.0-alpha'
+
+# image rows per band of the streamed (`--tiled`) ingestion and build
+BAND_ROWS = 256
+# control output: palette value -> color code, matrix rows per written chunk
+# and the longest side of the preview image
+CONTROL_CODES = ((225, 1), (15, 2), (40, 3), (45, 4), (190, 5), (195, 6), (220, 7))
+CONTROL_ROWS = 1024
+PREVIEW_SIDE = 2048
+
+
+def control(mtrx_arr, graphdict, text=True, preview=False):
+    """
+    Control: Maze array and graph printed in txt files for easy checking.
+    The palette values are color coded with one lookup table pass per
+    chunk of rows and all files are written chunk by chunk, so the matrix
+    is never copied as a whole. `preview` writes a downscaled PNG of the
+    color codes instead of (or with) the text dumps.
+    """
 
     # for color coding use:
-    rep = [(225, 1), (15, 2), (40, 3), (45, 4), (190, 5), (195, 6), (220, 7)]
-    arr_copy = np.copy(mtrx_arr)
-
-    for (o_val, n_val) in rep:
-        mtrx_arr[arr_copy == o_val] = n_val
+    code_lut = np.arange(256, dtype=np.uint8)
+    for (o_val, n_val) in CONTROL_CODES:
+        code_lut[o_val] = n_val
 
     if not Path('control').exists():
         Path('control').mkdir(parents=True, exist_ok=True)
-    # array human readable in txtfile
-    with open('control/array.txt', 'w') as nfi:
-        np.savetxt(nfi, mtrx_arr, fmt='%03u')
-    with open('control/array_changed.txt', 'w') as nfi:
-        np.savetxt(nfi, mtrx_arr, fmt='%u')
+    if preview:
+        control_preview(mtrx_arr, code_lut, 'control/preview.png')
+    if not text:
+        return
+
     # array spacesaving in np file; reusable
-    with open('control/matrixarr.npy', 'wb') as nfi:
-        np.save(nfi, mtrx_arr)
-    # graph human readable in txtfile
-    with open('control/graph.txt', 'w') as nfi:
-        pprint.pprint(graphdict, stream=nfi, width=160, compact=True)
+    codes = np.lib.format.open_memmap('control/matrixarr.npy', mode='w+', dtype=np.uint8, shape=mtrx_arr.shape)
+    # array human readable in txtfiles; the same text as np.savetxt
+    with open('control/array.txt', 'wb') as nfi, open('control/array_changed.txt', 'wb') as cfi:
+        for y_beg in range(0, mtrx_arr.shape[0], CONTROL_ROWS):
+            chunk = code_lut[mtrx_arr[y_beg:y_beg + CONTROL_ROWS]]
+            codes[y_beg:y_beg + chunk.shape[0]] = chunk
+            nfi.write(text_rows(chunk, '%03u'))
+            cfi.write(text_rows(chunk, '%u'))
+    codes.flush()
+    del codes
+
+    # graph human readable in txtfile; one node per line
+    if graphdict is not None:
+        with open('control/graph.txt', 'w') as nfi:
+            items = iter(graphdict.items())
+            while True:
+                lines = [f'{node!r}: {links!r},' for node, links in islice(items, CONTROL_ROWS * 16)]
+                if not lines:
+                    break
+                print('\n'.join(lines), file=nfi)
+
+
+def text_rows(chunk, fmt):
+    """Formats the rows of a uint8 matrix like np.savetxt(fmt=fmt), but
+    with a lookup table of the 256 possible entries instead of string
+    formatting per value."""
+    entries = [(fmt % val).encode() + b' ' for val in range(256)]
+    width = max(map(len, entries))
+    table = np.zeros((256, width), dtype=np.uint8)
+    for val, entry in enumerate(entries):
+        table[val, :len(entry)] = np.frombuffer(entry, dtype=np.uint8)
+    lengths = np.array([len(entry) for entry in entries])
+
+    if not chunk.size:
+        return b'\n' * chunk.shape[0]
+    flat = chunk.ravel()
+    text = table[flat][np.arange(width) < lengths[flat][:, None]]
+    # the separator after the last entry of a row becomes the line break
+    row_ends = np.cumsum(lengths[flat].reshape(chunk.shape).sum(axis=1)) - 1
+    text[row_ends] = ord('\n')
+    return text.tobytes()
+
+
+def control_preview(mtrx_arr, code_lut, filepath, max_side=PREVIEW_SIDE):
+    """Writes the color codes of the matrix downscaled to `max_side` as PNG.
+    Every preview pixel shows the highest code of its block, so narrow
+    walkable paths stay visible."""
+    gsy, gsx = mtrx_arr.shape
+    scale = max(-(-max(gsy, gsx) // max_side), 1)
+    p_y, p_x = -(-gsy // scale), -(-gsx // scale)
+    small = np.zeros((p_y, p_x), dtype=np.uint8)
+    band_rows = max(CONTROL_ROWS // scale, 1) * scale
+    for y_beg in range(0, gsy, band_rows):
+        chunk = code_lut[mtrx_arr[y_beg:y_beg + band_rows]]
+        rows = -(-chunk.shape[0] // scale)
+        block = np.zeros((rows * scale, p_x * scale), dtype=np.uint8)
+        block[:chunk.shape[0], :gsx] = chunk
+        small[y_beg // scale:y_beg // scale + rows] = block.reshape(rows, scale, p_x, scale).max(axis=(1, 3))
+
+    # black unwalkable, white code 1, distinct colors for the other codes
+    palette = [0, 0, 0, 255, 255, 255, 230, 25, 75, 60, 180, 75, 255, 225, 25,
+               0, 130, 200, 245, 130, 48, 145, 30, 180] + [128] * 3 * 248
+    img = Image.fromarray(small, 'P')
+    img.putpalette(palette)
+    img.save(filepath)
+
+
+def label_components(walk):
+    '''
+    Labels the 8-connected walkable areas of a bool matrix: 0 marks the
+    unwalkable cells, 1...n the areas. This is a vectorized union-find; the
+    roots of linked cells are hooked on the smaller one and then compressed,
+    until no link spans two roots.
+    '''
+    gsy, gsx = walk.shape
+    nys, nxs = np.nonzero(walk)
+    ids = np.full((gsy + 2, gsx + 2), -1, dtype=np.int64)
+    ids[nys + 1, nxs + 1] = np.arange(nys.size)
+
+    # the forward directions cover every link once
+    srcs, dests = [], []
+    for d_name, (d_y, d_x) in DIRS:
+        if d_name in ('NE', 'E', 'SE', 'S'):
+            nbr = ids[nys + 1 + d_y, nxs + 1 + d_x]
+            sel = nbr >= 0
+            srcs.append(np.nonzero(sel)[0])
+            dests.append(nbr[sel])
+    root = union_roots(nys.size, np.concatenate(srcs), np.concatenate(dests))
+
+    labels = np.zeros((gsy, gsx), dtype=np.int32)
+    labels[nys, nxs] = np.unique(root, return_inverse=True)[1] + 1
+    return labels
+
+
+def union_roots(size, src, dest):
+    '''Vectorized union-find over the elements 0...size-1 with the links
+    src[i] - dest[i]; returns the smallest element of its set for every
+    element.'''
+    root = np.arange(size)
+    while True:
+        r_src, r_dest = root[src], root[dest]
+        split = r_src != r_dest
+        if not split.any():
+            break
+        r_src, r_dest = r_src[split], r_dest[split]
+        np.minimum.at(root, np.maximum(r_src, r_dest), np.minimum(r_src, r_dest))
+        while True:
+            jumped = root[root]
+            if np.array_equal(jumped, root):
+                break
+            root = jumped
+    return root
+
+
+def raw_rows(img, maskimg):
+    """Returns a read-only memory map of the pixel rows if the image file
+    stores them uncompressed with one byte per pixel (PGM, 8 bit BMP and
+    TIFF); else None."""
+    if img.mode not in ('L', 'P') or len(img.tile) != 1 or not isinstance(maskimg, (str, Path)):
+        return None
+    codec, _extents, offset, args = img.tile[0][:4]
+    args = args if isinstance(args, tuple) else (args,)
+    if codec != 'raw' or args[0] != img.mode:
+        return None
+    gsx, gsy = img.size
+    stride = args[1] if len(args) > 1 and args[1] else gsx
+    orientation = args[2] if len(args) > 2 else 1
+    rows = np.memmap(maskimg, dtype=np.uint8, mode='r', offset=offset, shape=(gsy, stride))[:, :gsx]
+    return rows[::-1] if orientation < 0 else rows
+
+
+def mask2bitmap(maskimg, bitmap_file, band_rows=BAND_ROWS):
+    """
+    Streams the walkability of a mask image band by band into a bit-packed
+    bitmap (`np.packbits` rows, 1 = walkable) in a memory-mapped `.npy`
+    file. Uncompressed images are read straight from the file; for the
+    others PIL has to decode the image once, but only one band at a time is
+    converted to palette values. The conversion runs without dithering, so
+    a band does not depend on its neighbors; for masks in pure palette
+    colors this is the same as `img_mask2matrix`. Returns the bitmap and
+    the grid size.
+    """
+    with Image.open(maskimg) as img:
+        gsx, gsy = img.size
+        bitmap = np.lib.format.open_memmap(bitmap_file, mode='w+', dtype=np.uint8,
+                                           shape=(gsy, -(-gsx // 8)))
+        rows = raw_rows(img, maskimg)
+        for y_beg in range(0, gsy, band_rows):
+            y_end = min(y_beg + band_rows, gsy)
+            if rows is not None:
+                band = rows[y_beg:y_end]
+            else:
+                band = np.array(img.crop((0, y_beg, gsx, y_end)).convert('P', dither=Image.Dither.NONE))
+            bitmap[y_beg:y_end] = np.packbits(band != 0, axis=1)
+    bitmap.flush()
+    return bitmap, (gsy, gsx)
+
+
+def bitmap_rows(bitmap, gsx, y_beg, y_end):
+    """Unpacks rows of a bitmap to bool; rows outside the grid are empty."""
+    gsy = bitmap.shape[0]
+    rows = np.zeros((y_end - y_beg, gsx), dtype=bool)
+    r_beg, r_end = max(y_beg, 0), min(y_end, gsy)
+    if r_beg < r_end:
+        rows[r_beg - y_beg:r_end - y_beg] = np.unpackbits(bitmap[r_beg:r_end], axis=1, count=gsx)
+    return rows
+
+
+def band_counts(bitmap, gsx, y_beg, y_end):
+    """Nodes per row and the number of links in the rows y_beg:y_end of a
+    bitmap; see `band_links`."""
+    pad = np.pad(bitmap_rows(bitmap, gsx, y_beg - 1, y_end + 1), ((0, 0), (1, 1)))
+    center = pad[1:-1, 1:-1]
+    link_cnt = sum(int(np.count_nonzero(center & pad[1 + d_y:pad.shape[0] - 1 + d_y, 1 + d_x:gsx + 1 + d_x]))
+                   for _d_name, (d_y, d_x) in DIRS)
+    return center.sum(axis=1), link_cnt
+
+
+def band_links(bitmap, gsx, y_beg, y_end, row_start):
+    """
+    Links of the nodes in the rows y_beg:y_end of a bitmap. One halo row
+    above and below stitches the band to its neighbors. Returns the band
+    coordinates of the nodes, the link counts per node, the direction codes
+    and the neighbor ids; `row_start` holds the global first node id of
+    every row.
+    """
+    pad = np.pad(bitmap_rows(bitmap, gsx, y_beg - 1, y_end + 1), ((0, 0), (1, 1)))
+    center = pad[1:-1, 1:-1]
+    nys, nxs = np.nonzero(center)
+    # node ids of the halo rows: first id of the row plus rank in the row
+    first = row_start[max(y_beg - 1, 0):y_end + 1]
+    first = np.concatenate(([0], first)) if y_beg == 0 else first
+    ids = np.cumsum(pad, axis=1, dtype=np.int64) - 1 + first[:, None]
+
+    # shifted slices instead of per node lookups; one column per direction
+    links = np.empty((nys.size, len(DIRS)), dtype=bool)
+    nbr_ids = np.empty((nys.size, len(DIRS)), dtype=np.int64)
+    b_y, b_x = pad.shape[0] - 1, gsx + 1
+    for idx, (_d_name, (d_y, d_x)) in enumerate(DIRS):
+        links[:, idx] = pad[1 + d_y:b_y + d_y, 1 + d_x:b_x + d_x][center]
+        nbr_ids[:, idx] = ids[1 + d_y:b_y + d_y, 1 + d_x:b_x + d_x][center]
+    dircodes = np.broadcast_to(np.arange(len(DIRS), dtype=np.uint8), links.shape)[links]
+    return nys, nxs, links.sum(axis=1), dircodes, nbr_ids[links]
+
+
+def bitmap2graph(bitmap, gridsize, filepath, band_rows=BAND_ROWS):
+    """
+    Builds the CSR graph of a bitmap band by band straight into a binary
+    graph file; only one band of links is in memory at a time. A first pass
+    counts nodes per row and links, the second one fills the sections. The
+    result is the same graph as `M2G.maze2csr`, without labels and costs.
+    """
+    gsy, gsx = gridsize
+    row_start = np.zeros(gsy + 1, dtype=np.int64)
+    valcount = 0
+    for y_beg in range(0, gsy, band_rows):
+        y_end = min(y_beg + band_rows, gsy)
+        row_start[y_beg + 1:y_end + 1], link_cnt = band_counts(bitmap, gsx, y_beg, y_end)
+        valcount += link_cnt
+    np.cumsum(row_start, out=row_start)
+    keycount = int(row_start[-1])
+
+    sections = create_graph_file(filepath, gridsize, keycount, valcount,
+                                 ('cells', 'offsets', 'neighbors', 'dircodes'), gsy * gsx >= 2**31)
+    sections['offsets'][0] = 0
+    link_pos = 0
+    for y_beg in range(0, gsy, band_rows):
+        y_end = min(y_beg + band_rows, gsy)
+        nys, nxs, counts, dircodes, neighbors = band_links(bitmap, gsx, y_beg, y_end, row_start)
+        n_beg, n_end = int(row_start[y_beg]), int(row_start[y_end])
+        sections['cells'][n_beg:n_end] = (nys.astype(np.int64) + y_beg) * gsx + nxs
+        sections['offsets'][n_beg + 1:n_end + 1] = link_pos + np.cumsum(counts)
+        sections['neighbors'][link_pos:link_pos + dircodes.size] = neighbors
+        sections['dircodes'][link_pos:link_pos + dircodes.size] = dircodes
+        link_pos += dircodes.size
+    for section in sections.values():
+        if isinstance(section, np.memmap):
+            section.flush()
+    return CsrGraph.read(filepath)
+
+
+def halo_links(mtrx, y_beg, y_end):
+    """Nodes and links of the rows y_beg:y_end of a matrix like
+    `M2G.link_masks`; one halo row above and below links the band to its
+    neighbors. The coordinates are global."""
+    gsy = mtrx.shape[0]
+    walk = mtrx[max(y_beg - 1, 0):y_end + 1] != 0
+    pad = np.pad(walk, ((int(y_beg == 0), int(y_end == gsy)), (1, 1)))
+    nys, nxs = np.nonzero(pad[1:-1, 1:-1])
+    links = np.empty((len(DIRS), nys.size), dtype=bool)
+    for idx, (_d_name, (d_y, d_x)) in enumerate(DIRS):
+        links[idx] = pad[1 + d_y + nys, 1 + d_x + nxs]
+    return nys + y_beg, nxs, links
+
+
+def _band_job(job):
+    """Pool task of `M2G.parallel_build`: attaches the shared matrices and
+    builds one band."""
+    names, shape, dtype, band, cost_lut = job
+    blocks = [SharedMemory(name=name) for name in names]
+    try:
+        return _band_build(blocks, shape, dtype, band, cost_lut)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def _band_build(blocks, shape, dtype, band, cost_lut):
+    """Nodes and links of a band; its band local component labels and
+    terrain costs go straight into the shared matrices. Returns the number
+    of labels too."""
+    y_beg, y_end = band
+    mtrx = np.ndarray(shape, dtype=dtype, buffer=blocks[0].buf)
+    labels = np.ndarray(shape, dtype=np.int32, buffer=blocks[1].buf)
+    nys, nxs, links = halo_links(mtrx, y_beg, y_end)
+    labels[y_beg:y_end] = label_components(mtrx[y_beg:y_end] != 0)
+    label_cnt = int(labels[y_beg:y_end].max(initial=0))
+    if cost_lut is not None:
+        costs = np.ndarray(shape, dtype=np.float32, buffer=blocks[2].buf)
+        costs[y_beg:y_end] = cost_lut[mtrx[y_beg:y_end]]
+    return nys, nxs, links, label_cnt
+
+
+def stitch_labels(labels, bands, label_cnts):
+    """Joins the band local labels of `M2G.parallel_build` in place: the
+    labels get distinct ranges, then the components linked across a border
+    between two bands are merged. The numbering is the same as the one of
+    `label_components`, since a merged component keeps its first label."""
+    first = 0
+    for (y_beg, y_end), label_cnt in zip(bands, label_cnts):
+        band = labels[y_beg:y_end]
+        band[band > 0] += first
+        first += label_cnt
+
+    gsx = labels.shape[1]
+    srcs, dests = [], []
+    for y_beg, _y_end in bands[1:]:
+        upper, lower = labels[y_beg - 1], labels[y_beg]
+        for d_x in (-1, 0, 1):
+            up_l = upper[max(-d_x, 0):gsx - max(d_x, 0)]
+            low_l = lower[max(d_x, 0):gsx - max(-d_x, 0)]
+            sel = (up_l > 0) & (low_l > 0)
+            srcs.append(up_l[sel])
+            dests.append(low_l[sel])
+    src = np.concatenate(srcs) if srcs else np.zeros(0, dtype=np.int32)
+    dest = np.concatenate(dests) if dests else np.zeros(0, dtype=np.int32)
+    root = union_roots(first + 1, src, dest)
+    lut = np.unique(root, return_inverse=True)[1].astype(np.int32)
+    labels[...] = lut[labels]
+    return labels
 
 
 class M2G:
     '''Main class for all graph building related functionality.'''
 
-    def __init__(self, maskimg):
+    def __init__(self, maskimg, cost_table=None):
         self.mtrx = np.array([[]])
         self.gsy, self.gsx = 0, 0
         self.graph = {}
+        # palette value -> traversal cost; None keeps the uniform cost 1
+        self.cost_table = cost_table
+        self.cost_lut = None
+        self.costs = None
+        self.built = False
+        self.labels = None
+        self.next_label = 1
+        self.stale_labels = set()
+        # called with (m2g, touched box) after every patch; for derived indexes
+        self.patch_hooks = []
+        self.revision = 0
         self.img_mask2matrix(maskimg)
 
     def img_mask2matrix(self, maskimg):
@@ -106,7 +435,224 @@ class M2G:
                 self.graph[src_n].append((dest_n, d1_name))
                 self.graph[dest_n].append((src_n, d2_name))
 
-    def maze2graph(self):
+    def link_masks(self):
+        '''Vectorized neighbor lookup. Returns the coordinates of all
+        walkable cells in row-major order and a bool array with one row per
+        direction in `DIRS`, which marks if the neighbor is walkable too.'''
+        walk = self.mtrx != 0
+        nys, nxs = np.nonzero(walk)
+        # a unwalkable border spares the range checks of `chk_pos`
+        pad = np.pad(walk, 1)
+        links = np.empty((len(DIRS), nys.size), dtype=bool)
+        for idx, (_d_name, (d_y, d_x)) in enumerate(DIRS):
+            shifted = pad[1 + d_y:1 + d_y + self.gsy, 1 + d_x:1 + d_x + self.gsx]
+            links[idx] = shifted[nys, nxs]
+        return nys, nxs, links
+
+    def parallel_build(self, workers, band_rows=None):
+        '''
+        Splits the matrix in horizontal bands and builds nodes, links,
+        band local labels and terrain costs of every band in a process pool.
+        The matrix, labels and costs live in shared memory; the workers get
+        only the block names. At the end the bands are stitched: node and
+        link arrays concatenated, labels joined over the band borders (see
+        `stitch_labels`). Returns the same as `link_masks` and sets
+        `labels` and `costs` like `label_components`/`terrain_costs`.
+        '''
+        shape, dtype = self.mtrx.shape, self.mtrx.dtype
+        band_rows = band_rows or max(-(-self.gsy // (4 * workers)), 1)
+        bands = [(y_beg, min(y_beg + band_rows, self.gsy)) for y_beg in range(0, self.gsy, band_rows)]
+        cost_lut = self.cost_lookup() if self.cost_table else None
+
+        sizes = [self.mtrx.nbytes, self.mtrx.size * 4] + ([self.mtrx.size * 4] if cost_lut is not None else [])
+        blocks = [SharedMemory(create=True, size=max(size, 1)) for size in sizes]
+        try:
+            np.ndarray(shape, dtype=dtype, buffer=blocks[0].buf)[...] = self.mtrx
+            jobs = [([block.name for block in blocks], shape, dtype, band, cost_lut) for band in bands]
+            with mp.Pool(workers) as pool:
+                parts = pool.map(_band_job, jobs)
+            labels = np.ndarray(shape, dtype=np.int32, buffer=blocks[1].buf).copy()
+            if cost_lut is not None:
+                self.costs = np.ndarray(shape, dtype=np.float32, buffer=blocks[2].buf).copy()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        self.labels = stitch_labels(labels, bands, [part[3] for part in parts])
+        self.next_label = int(self.labels.max(initial=0)) + 1
+        self.stale_labels = set()
+        nys = np.concatenate([part[0] for part in parts])
+        nxs = np.concatenate([part[1] for part in parts])
+        links = np.concatenate([part[2] for part in parts], axis=1)
+        return nys, nxs, links
+
+    def maze2graph_vec(self, masks=None):
+        '''Builds the same graph dict as the loop in `maze2graph`, but finds
+        nodes and links with numpy masks instead of per pixel lookups.
+        `masks` takes a finished result of `link_masks` in.'''
+        nys, nxs, links = masks if masks is not None else self.link_masks()
+        nodes = list(zip(nys.tolist(), nxs.tolist()))
+        self.graph = {node: [] for node in nodes}
+
+        # direction by direction keeps the order of the link lists
+        for idx, (d_name, (d_y, d_x)) in enumerate(DIRS):
+            sel = np.nonzero(links[idx])[0]
+            dests = zip((nys[sel] + d_y).tolist(), (nxs[sel] + d_x).tolist())
+            for src_i, dest_n in zip(sel.tolist(), dests):
+                self.graph[nodes[src_i]].append((dest_n, d_name))
+
+    def label_components(self):
+        '''Computes the component label matrix of the walkable area; cells
+        with different labels have no path between them.'''
+        self.labels = label_components(self.mtrx != 0)
+        self.next_label = int(self.labels.max()) + 1
+        self.stale_labels = set()
+        return self.labels
+
+    def terrain_costs(self):
+        '''Maps the palette values of the matrix in one lookup table pass to
+        a float32 matrix of traversal costs per cell. Unwalkable cells get
+        0, palette values missing in `cost_table` the cost 1. A move costs
+        its step length times the mean cost of both cells.'''
+        self.costs = self.cost_lookup()[self.mtrx]
+        return self.costs
+
+    def cost_lookup(self):
+        '''Builds the 256 entry lookup table palette value -> cost of
+        `terrain_costs`.'''
+        self.cost_lut = np.ones(256, dtype=np.float32)
+        self.cost_lut[0] = 0
+        for p_val, cost in (self.cost_table or {}).items():
+            if p_val == 0:
+                continue
+            if not cost > 0:
+                raise ValueError(f"Terrain cost for palette value {p_val} must be positive.")
+            self.cost_lut[p_val] = cost
+        return self.cost_lut
+
+    def refresh_labels(self):
+        '''Relabels only the cells of components which lost cells by a
+        patch and could be split now; see `update_cells`.'''
+        if self.labels is None or not self.stale_labels:
+            return self.labels
+        stale = np.isin(self.labels, list(self.stale_labels))
+        nys, nxs = np.nonzero(stale)
+        if nys.size:
+            y_min, y_max, x_min, x_max = nys.min(), nys.max() + 1, nxs.min(), nxs.max() + 1
+            sub_stale = stale[y_min:y_max, x_min:x_max]
+            sub_labels = label_components(sub_stale)
+            self.labels[y_min:y_max, x_min:x_max][sub_stale] = sub_labels[sub_stale] + self.next_label - 1
+            self.next_label += int(sub_labels.max())
+        self.stale_labels = set()
+        return self.labels
+
+    def maze2csr(self, workers=None):
+        '''Builds the graph in the compact CSR format; see `CsrGraph`. With
+        `workers` > 1 the bands are built in parallel (`parallel_build`).'''
+        if workers and workers > 1:
+            csr = CsrGraph.from_links((self.gsy, self.gsx), *self.parallel_build(workers))
+            csr.labels, csr.costs = self.labels, self.costs
+            return csr
+        nys, nxs, links = self.link_masks()
+        csr = CsrGraph.from_links((self.gsy, self.gsx), nys, nxs, links)
+        csr.labels = self.label_components()
+        if self.cost_table:
+            csr.costs = self.terrain_costs()
+        return csr
+
+    def patch(self, y_pos, x_pos, values):
+        '''Writes a rectangular patch of palette values (0 is unwalkable)
+        with the upper left corner at (y_pos, x_pos) into the matrix and
+        updates graph and labels in place. `values` is a 2d array or a
+        scalar for one cell. Returns the touched box of cells as
+        (y_min, y_max, x_min, x_max).'''
+        values = np.atleast_2d(np.asarray(values, dtype=self.mtrx.dtype))
+        p_y, p_x = values.shape
+        if y_pos < 0 or x_pos < 0 or y_pos + p_y > self.gsy or x_pos + p_x > self.gsx:
+            raise ValueError("Patch lies not completely inside the grid.")
+        cells = [(y_pos + i, x_pos + j) for i in range(p_y) for j in range(p_x)]
+        return self.update_cells(cells, values.ravel().tolist())
+
+    def patch_cells(self, cells, value):
+        '''Sets a list of (y, x) cells to one palette value; see `patch`.'''
+        for y_pos, x_pos in cells:
+            if not (0 <= y_pos < self.gsy and 0 <= x_pos < self.gsx):
+                raise ValueError(f"Cell {(y_pos, x_pos)} lies outside the grid.")
+        return self.update_cells(cells, [value] * len(cells))
+
+    def update_cells(self, cells, values):
+        '''
+        Applies new values cell by cell. Only cells which change between
+        walkable and unwalkable touch the graph: their node and links are
+        added or removed. The labels stay exact for added cells (touched
+        components get merged); a removal could split its component, so
+        that label is just marked stale for `refresh_labels`. Different
+        labels mean always "no path". An empty cell list touches nothing and
+        returns None.
+        '''
+        if not cells:
+            return None
+        for node, value in zip(cells, values):
+            was_walkable = self.mtrx[node] != 0
+            self.mtrx[node] = value
+            if self.costs is not None:
+                self.costs[node] = self.cost_lut[value]
+            if was_walkable == (value != 0):
+                continue
+            if value != 0:
+                self.patch_add(node)
+            else:
+                self.patch_remove(node)
+
+        nys, nxs = zip(*cells)
+        box = (min(nys), max(nys) + 1, min(nxs), max(nxs) + 1)
+        self.revision += 1
+        for hook in self.patch_hooks:
+            hook(self, box)
+        return box
+
+    def walkable_nbrs(self, node):
+        '''Returns the walkable neighbors of a cell with the direction.'''
+        y_pos, x_pos = node
+        return [((y_pos + d_y, x_pos + d_x), d_name) for d_name, (d_y, d_x) in DIRS
+                if 0 <= y_pos + d_y < self.gsy and 0 <= x_pos + d_x < self.gsx
+                and self.mtrx[y_pos + d_y, x_pos + d_x] != 0]
+
+    def patch_add(self, node):
+        '''Adds a cell which became walkable to graph and labels.'''
+        nbrs = self.walkable_nbrs(node)
+        if self.built:
+            self.graph[node] = []
+            for nbr, d_name in nbrs:
+                self.graph[node].append((nbr, d_name))
+                self.graph[nbr].append((node, REV_DIRS[d_name]))
+
+        if self.labels is not None:
+            nbr_labels = {int(self.labels[nbr]) for nbr, _d_name in nbrs}
+            if not nbr_labels:
+                self.labels[node] = self.next_label
+                self.next_label += 1
+                return
+            label = min(nbr_labels)
+            for other in nbr_labels - {label}:
+                self.labels[self.labels == other] = label
+                if other in self.stale_labels:
+                    self.stale_labels.discard(other)
+                    self.stale_labels.add(label)
+            self.labels[node] = label
+
+    def patch_remove(self, node):
+        '''Removes a cell which became unwalkable from graph and labels.'''
+        if self.built:
+            for nbr, d_name in self.graph.pop(node):
+                self.graph[nbr].remove((node, REV_DIRS[d_name]))
+
+        if self.labels is not None:
+            self.stale_labels.add(int(self.labels[node]))
+            self.labels[node] = 0
+
+    def maze2graph(self, vectorize=False, workers=None):
         '''
         Builds a simple graph dict from a maze/map array. The cells of
         the walkable area are noted as "keys"; their neighbor nodes as
@@ -115,16 +661,30 @@ class M2G:
         The structure looks like this:
         {(23, 8): [((23, 9), 'E'), ((24, 9), 'SE'), ...],
         (23, 9): [(23, 8)...], ...}
-        '''
 
-        for i in range(self.gsy):
-            for j in range(self.gsx):
-                # filter unwalkable cells out
-                if self.mtrx[i][j] != 0:
-                    self.add_node((i, j))
+        With `workers` > 1 nodes, links, labels and costs are built band
+        wise in a process pool (see `parallel_build`).
+        '''
 
-        for node in self.graph:
-            self.add_link(node)
+        parallel = bool(workers and workers > 1)
+        if parallel:
+            self.maze2graph_vec(self.parallel_build(workers))
+        elif vectorize:
+            self.maze2graph_vec()
+        else:
+            for i in range(self.gsy):
+                for j in range(self.gsx):
+                    # filter unwalkable cells out
+                    if self.mtrx[i][j] != 0:
+                        self.add_node((i, j))
+
+            for node in self.graph:
+                self.add_link(node)
+        self.built = True
+        if not parallel:
+            self.label_components()
+            if self.cost_table:
+                self.terrain_costs()
 
         keycount = (len(self.graph.keys()))
         valcount = (sum(map(len, self.graph.values())))
@@ -132,24 +692,23 @@ class M2G:
         return self.graph, (self.gsy, self.gsx), self.mtrx, keycount, valcount
 
 
-def store_data(graphdict, gridsize, keycount, valcount):
-    """Writes the graph and the variable `gridsize´ to files."""
+def store_data(graphdict, gridsize, labels=None, costs=None):
+    """Writes the graph with grid size, component labels and terrain costs
+    in one binary graph file (see `CsrGraph.write`)."""
 
     if not Path('graphdata').exists():
         Path('graphdata').mkdir(parents=True, exist_ok=True)
-    with open('graphdata/graph.pickle', 'wb') as nfi:
-        pickle.dump(graphdict, nfi, protocol=pickle.HIGHEST_PROTOCOL)
+    csr = CsrGraph.from_dict(gridsize, graphdict)
+    csr.labels, csr.costs = labels, costs
+    csr.write('graphdata/graph.m2g')
 
-    filehead = (f"""\
-    # -*- coding: utf-8 -*-
 
-    \"\"\"Module for reusable storage of a variable.\"\"\"
+def store_csr(csr):
+    """Writes the compact graph to a npz file."""
 
-    gridsize = {gridsize}
-    key_count = {keycount}
-    value_count = {valcount}""")
-    with open('graphdata/graphinfo.py', 'w') as nfi:
-        print(dedent(filehead), file=nfi)
+    if not Path('graphdata').exists():
+        Path('graphdata').mkdir(parents=True, exist_ok=True)
+    csr.save('graphdata/graph.npz')
 
 
 def get_args():
@@ -169,22 +728,65 @@ def get_args():
             print('Input must be a PIL supported image file.')
         return in_file
 
+    def cost_table(inp):
+        '''Help function to read a table like `225:1,15:2.5` in.'''
+        try:
+            return {int(p_val): float(cost) for p_val, cost in
+                    (pair.split(':') for pair in inp.split(','))}
+        except ValueError:
+            raise parser.error(f'{inp} is no valid cost table (value:cost,...).')
+
     parser = argparse.ArgumentParser(
-        description='Turns a image used as mask into a pickel file with the stored graph.')
+        description='Turns a image used as mask into a graph file (graphdata/graph.m2g).')
     parser.add_argument('imgfile', action='store', type=valid_img,
                         metavar='Image file',
                         help='Image file for processing.')
+    parser.add_argument('--vec', action='store_true', dest='vectorize',
+                        help='Build the graph with numpy masks instead of the pixel loop.')
+    parser.add_argument('--csr', action='store_true',
+                        help='Build the graph straight as CSR arrays and store it as graphdata/graph.npz.')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='Build the bands of the graph in parallel with this many processes.')
+    parser.add_argument('--tiled', action='store_true',
+                        help='Stream huge masks band by band into a bitmap and the graph file; '
+                             'no labels, costs and control files.')
+    parser.add_argument('--band-rows', type=int, default=BAND_ROWS,
+                        help='Image rows per band of --tiled.')
+    parser.add_argument('--control', choices=('text', 'preview', 'both', 'none'), default='text',
+                        help='Control output: text dumps, a downscaled PNG preview, both or none.')
+    parser.add_argument('--costs', type=cost_table, dest='cost_table',
+                        help='Terrain costs per palette value, e.g. 225:1,15:2.5 (default: all 1).')
     return parser.parse_args()
 
 
+def control_out(cfg, mtrx_arr, graphdict):
+    '''Writes the control files chosen with `--control`.'''
+    if cfg.control != 'none':
+        control(mtrx_arr, graphdict, text=cfg.control in ('text', 'both'),
+                preview=cfg.control in ('preview', 'both'))
+
+
 def main(cfg):
     '''... main function.'''
 
-    m2g = M2G(cfg.imgfile)
-    graphdict, gridsize, mtrx_arr, keycount, valcount = m2g.maze2graph()
+    if cfg.tiled:
+        if not Path('graphdata').exists():
+            Path('graphdata').mkdir(parents=True, exist_ok=True)
+        bitmap, gridsize = mask2bitmap(cfg.imgfile, 'graphdata/walk.npy', cfg.band_rows)
+        bitmap2graph(bitmap, gridsize, 'graphdata/graph.m2g', cfg.band_rows)
+        return
+
+    m2g = M2G(cfg.imgfile, cfg.cost_table)
+    if cfg.csr:
+        csr = m2g.maze2csr(cfg.workers)
+        control_out(cfg, m2g.mtrx, None)
+        store_csr(csr)
+        return
+
+    graphdict, gridsize, mtrx_arr, _keycount, _valcount = m2g.maze2graph(cfg.vectorize, cfg.workers)
 
-    control(mtrx_arr, graphdict)
-    store_data(graphdict, gridsize, keycount, valcount)
+    control_out(cfg, mtrx_arr, graphdict)
+    store_data(graphdict, gridsize, m2g.labels, m2g.costs)
 
 
 if __name__ == '__main__':
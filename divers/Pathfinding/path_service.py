@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+'''
+Batch path service: answers many (start, goal) queries against one loaded
+graph. The search state is allocated once and reused over all queries.
+'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+import multiprocessing as mp
+from heapq import heappop, heappush
+from math import sqrt
+import numpy as np
+from astar_search import GraphPathSearch
+from csrgraph import DIRS
+
+__title__ = 'path_service'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.4.0-alpha'
+
+# step cost per direction code of the CSR graph
+DIR_COST = tuple(sqrt(2) if d_y and d_x else 1.0 for _d_name, (d_y, d_x) in DIRS)
+
+
+class BatchPathSearch:
+    '''
+    A* over the integer node ids of a `CsrGraph` for a batch of queries.
+
+    Instead of fresh `explored`/`cur_cost` dicts per query it keeps
+    preallocated cost/parent arrays and a generation counter per node: a
+    entry is only valid if its generation is the one of the current query,
+    so nothing needs to be cleared between queries.
+
+    The graph stays in compact numpy arrays (node coords, offsets, links,
+    step costs); the search indexes them through memoryviews, which is as
+    fast as lists without a Python object per entry. Only the search state
+    is per instance.
+    '''
+
+    diag = GraphPathSearch.diag
+
+    def __init__(self, csr):
+        self.csr = csr
+        gsx = csr.gsx
+        node_cnt = csr.keycount
+        cells = np.asarray(csr.cells)
+        self.ys = (cells // gsx).astype(np.int32)
+        self.xs = (cells % gsx).astype(np.int32)
+        self.offsets = np.ascontiguousarray(csr.offsets)
+        self.neighbors = np.ascontiguousarray(csr.neighbors)
+        steps = np.array(DIR_COST)[csr.dircodes]
+        self.hscale = 1.0
+        if csr.costs is not None:
+            # terrain: step length times the mean cost of both cells
+            node_costs = csr.costs.ravel()[csr.cells].astype(np.float64)
+            src_ids = np.repeat(np.arange(node_cnt), np.diff(csr.offsets))
+            steps *= 0.5 * (node_costs[src_ids] + node_costs[csr.neighbors])
+            self.hscale = float(node_costs.min()) if node_cnt else 1.0
+        self.steps = steps
+
+        self.cost = [0.0] * node_cnt
+        self.parent = [-1] * node_cnt
+        self.touched = [0] * node_cnt
+        self.closed = [0] * node_cnt
+        self.generation = 0
+
+    def views(self):
+        '''Memoryviews of the graph arrays; numpy scalars would be slow in
+        the hot loop.'''
+        return tuple(memoryview(arr) for arr in (self.ys, self.xs, self.offsets,
+                                                 self.neighbors, self.steps))
+
+    def query_ids(self, src, dst):
+        '''A* between two node ids. Returns the id pathway and its costs or
+        ([], None) if the goal is not reachable.'''
+
+        self.generation += 1
+        gen = self.generation
+        cost, parent, touched, closed = self.cost, self.parent, self.touched, self.closed
+        ys, xs, offsets, neighbors, steps = self.views()
+        diag, hscale = self.diag, self.hscale
+        g_y, g_x = ys[dst], xs[dst]
+
+        cost[src] = 0.0
+        parent[src] = -1
+        touched[src] = gen
+        frontier = [(0.0, src)]
+        while frontier:
+            current = heappop(frontier)[1]
+            if current == dst:
+                break
+            if closed[current] == gen:
+                continue
+            closed[current] = gen
+
+            cur_cost = cost[current]
+            for idx in range(offsets[current], offsets[current + 1]):
+                nxt = neighbors[idx]
+                new_cost = cur_cost + steps[idx]
+                if touched[nxt] != gen or new_cost < cost[nxt]:
+                    touched[nxt] = gen
+                    cost[nxt] = new_cost
+                    parent[nxt] = current
+                    y_dif = abs(ys[nxt] - g_y)
+                    x_dif = abs(xs[nxt] - g_x)
+                    priority = new_cost + hscale * ((x_dif + y_dif) + diag * min(x_dif, y_dif))
+                    heappush(frontier, (priority, nxt))
+        else:
+            return [], None
+
+        pathway = []
+        cur_node = dst
+        while cur_node != -1:
+            pathway.append(cur_node)
+            cur_node = parent[cur_node]
+        pathway.reverse()
+        return pathway, cost[dst]
+
+    def query(self, start, goal):
+        '''A* between two (y, x) nodes. Returns the pathway as list of nodes
+        and its costs or ([], None) if there is no path.'''
+        src, dst = self.csr.node_id(start), self.csr.node_id(goal)
+        if src is None or dst is None:
+            return [], None
+        labels = self.csr.labels
+        if labels is not None and labels[start] != labels[goal]:
+            return [], None
+        id_path, path_cost = self.query_ids(src, dst)
+        ys, xs = memoryview(self.ys), memoryview(self.xs)
+        return [(ys[nid], xs[nid]) for nid in id_path], path_cost
+
+    def run(self, queries, workers=None, chunksize=64):
+        '''Answers a list of (start, goal) pairs in order. With `workers` the
+        queries are spread over a process pool; every worker gets the
+        prepared arrays once at start and keeps its own search state. With
+        fork the arrays are shared with the parent (nothing writes to them,
+        so the pages are not copied); with spawn every worker unpickles its
+        own copy of the arrays.'''
+        if not workers or workers < 2:
+            return [self.query(start, goal) for start, goal in queries]
+
+        with mp.Pool(workers, initializer=_init_worker, initargs=(self,)) as pool:
+            return pool.map(_worker_query, queries, chunksize=chunksize)
+
+
+# state of a pool worker; set once by the initializer
+_worker_bps = None
+
+
+def _init_worker(bps):
+    '''Pool initializer: takes the `BatchPathSearch` of the parent; the
+    search state lists become private to the worker on the first write.'''
+    global _worker_bps
+    _worker_bps = bps
+
+
+def _worker_query(pair):
+    '''Pool task: one (start, goal) query.'''
+    return _worker_bps.query(*pair)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+'''
+Path smoothing: reduces a cell by cell pathway of the searches to the
+waypoints of a any-angle path. Two waypoints are joined directly if the
+straight line between the cell centers touches only walkable cells.
+'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+import numpy as np
+
+__title__ = 'path_smoothing'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.1.0-alpha'
+
+
+def supercover(src, dst):
+    '''
+    All cells which the line between the centers of two cells touches,
+    also the ones it only grazes in a corner; as arrays (ys, xs), can hold
+    a cell more than once. Vectorized and exact: the crossings with the
+    cell borders are computed in integer arithmetic.
+    '''
+    (y_0, x_0), (y_1, x_1) = src, dst
+    d_y, d_x = y_1 - y_0, x_1 - x_0
+    ys, xs = [np.array([y_0, y_1])], [np.array([x_0, x_1])]
+
+    # crossings of the vertical borders x = k + 0.5; there y = num / den
+    if d_x:
+        step = 1 if d_x > 0 else -1
+        borders2 = np.arange(2 * x_0 + step, 2 * x_1, 2 * step, dtype=np.int64)
+        num, den = 2 * y_0 * d_x + d_y * (borders2 - 2 * x_0), 2 * d_x
+        if den < 0:
+            num, den = -num, -den
+        # cells below and above y; the same if y is no cell border
+        y_lo, y_hi = -((den // 2 - num) // den), (num + den // 2) // den
+        x_lo, x_hi = (borders2 - 1) // 2, (borders2 + 1) // 2
+        ys += [y_lo, y_lo, y_hi, y_hi]
+        xs += [x_lo, x_hi, x_lo, x_hi]
+    # crossings of the horizontal borders y = k + 0.5
+    if d_y:
+        step = 1 if d_y > 0 else -1
+        borders2 = np.arange(2 * y_0 + step, 2 * y_1, 2 * step, dtype=np.int64)
+        num, den = 2 * x_0 * d_y + d_x * (borders2 - 2 * y_0), 2 * d_y
+        if den < 0:
+            num, den = -num, -den
+        x_lo, x_hi = -((den // 2 - num) // den), (num + den // 2) // den
+        y_lo, y_hi = (borders2 - 1) // 2, (borders2 + 1) // 2
+        ys += [y_lo, y_hi, y_lo, y_hi]
+        xs += [x_lo, x_lo, x_hi, x_hi]
+    return np.concatenate(ys), np.concatenate(xs)
+
+
+class PathSmoother:
+    '''
+    String pulling over a walkability matrix like `M2G.mtrx`.
+
+    Terrain costs are not considered: a shortcut is taken if it is free of
+    obstacles, also through expensive terrain.
+    '''
+
+    def __init__(self, mtrx):
+        self.walk = np.asarray(mtrx) != 0
+
+    @classmethod
+    def from_graph(cls, csr):
+        '''Smoother for a `CsrGraph`; the walkable cells are its nodes.'''
+        walk = np.zeros(csr.gridsize, dtype=bool)
+        walk.ravel()[np.asarray(csr.cells)] = True
+        return cls(walk)
+
+    def line_of_sight(self, src, dst):
+        '''Checks if the line between two cell centers is free.'''
+        ys, xs = supercover(src, dst)
+        return bool(self.walk[ys, xs].all())
+
+    @staticmethod
+    def turning_points(pathway):
+        '''Indices of the start, the goal and every cell where the direction
+        of the pathway changes; the cells between them lie on a line.'''
+        steps = np.diff(np.asarray(pathway), axis=0)
+        turns = np.nonzero((steps[1:] != steps[:-1]).any(axis=1))[0] + 1
+        return [0] + turns.tolist() + [len(pathway) - 1]
+
+    def smooth(self, pathway):
+        '''
+        Reduces a pathway to its any-angle waypoints: from the last waypoint
+        the next turning point is checked for line of sight; the first one
+        which fails makes the one before it a new waypoint. A straight run
+        of the pathway stays usable as it is, also where a diagonal passes a
+        blocked corner like the graph links allow it.
+        '''
+        if len(pathway) < 3:
+            return list(pathway)
+
+        candidates = self.turning_points(pathway)
+        waypoints = [pathway[0]]
+        anchor = 0
+        for prev, cand in zip(candidates, candidates[1:]):
+            # the run between two turning points is straight and walkable;
+            # no waypoint is needed as long as the anchor starts it
+            if prev != anchor and not self.line_of_sight(pathway[anchor], pathway[cand]):
+                waypoints.append(pathway[prev])
+                anchor = prev
+        waypoints.append(pathway[-1])
+        return waypoints
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Benchmark harness for the graph build, the graph files and the path search.
+Runs on generated maps (maze, open field, random obstacles) in several sizes
+and on the shipped masks; the results go as JSON to a file, so runs of
+different versions can be compared with `--compare`.
+'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import multiprocessing as mp
+from pathlib import Path
+import numpy as np
+from PIL import Image
+import astar_search
+import csrgraph
+import maze2graph
+import path_service
+from astar_search import GraphPathSearch
+from csrgraph import CsrGraph
+from maze2graph import M2G
+from path_service import BatchPathSearch
+
+__title__ = 'pathbench'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.1.0-alpha'
+
+SHIPPED_MASKS = ('mask22x14.webp', 'mask1920x1080.webp')
+# metrics checked by `--compare`; all of them are "lower is better"
+TRACKED = ('build_vec_s', 'build_csr_s', 'labels_s', 'bin_load_s', 'npz_load_s',
+           'astar_p50_ms', 'astar_p99_ms', 'bidir_p50_ms', 'batch_q_ms', 'peak_rss_kb')
+
+
+def maze_map(size, rng):
+    '''Perfect maze of a randomized depth first search; corridors and walls
+    are one cell wide, so routes are long and winding.'''
+    c_y, c_x = (size - 1) // 2, (size - 1) // 2
+    mtrx = np.zeros((size, size), dtype=np.uint8)
+    seen = np.zeros((c_y, c_x), dtype=bool)
+    steps = ((-1, 0), (1, 0), (0, -1), (0, 1))
+    stack = [(0, 0)]
+    seen[0, 0] = True
+    mtrx[1, 1] = 255
+    while stack:
+        y_pos, x_pos = stack[-1]
+        nbrs = [(y_pos + d_y, x_pos + d_x) for d_y, d_x in steps
+                if 0 <= y_pos + d_y < c_y and 0 <= x_pos + d_x < c_x and not seen[y_pos + d_y, x_pos + d_x]]
+        if not nbrs:
+            stack.pop()
+            continue
+        n_y, n_x = nbrs[rng.integers(len(nbrs))]
+        seen[n_y, n_x] = True
+        # open the cell and the wall between both
+        mtrx[2 * n_y + 1, 2 * n_x + 1] = 255
+        mtrx[y_pos + n_y + 1, x_pos + n_x + 1] = 255
+        stack.append((n_y, n_x))
+    return mtrx
+
+
+def open_field(size, _rng):
+    '''Walkable area with a unwalkable border only.'''
+    mtrx = np.zeros((size, size), dtype=np.uint8)
+    mtrx[1:-1, 1:-1] = 255
+    return mtrx
+
+
+def obstacle_map(size, rng, density=0.3):
+    '''Open field with randomly placed unwalkable cells.'''
+    mtrx = open_field(size, rng)
+    mtrx[rng.random((size, size)) < density] = 0
+    return mtrx
+
+
+GENERATORS = {'maze': maze_map, 'open': open_field, 'obstacles': obstacle_map}
+
+
+def mask_file(mtrx):
+    '''Packs a matrix as PNG in memory, so generated maps take the same
+    image route into `M2G` as the real masks.'''
+    buf = io.BytesIO()
+    Image.fromarray(mtrx, 'L').save(buf, 'PNG')
+    buf.seek(0)
+    return buf
+
+
+def peak_rss():
+    '''Peak resident set size of this process in KiB (macOS reports bytes).'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def timed(func, *args, **kwargs):
+    '''Calls a function; returns its result and the runtime in seconds.'''
+    t_beg = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - t_beg
+
+
+def query_pairs(labels, count, rng):
+    '''Random (start, goal) pairs of walkable cells; both cells of a pair
+    lie in the same component, so every query finds a path.'''
+    nys, nxs = np.nonzero(labels)
+    if not nys.size:
+        return []
+    starts = rng.integers(nys.size, size=count)
+    flat_labels = labels[nys, nxs]
+    pairs = []
+    for s_idx in starts.tolist():
+        same = np.nonzero(flat_labels == flat_labels[s_idx])[0]
+        g_idx = int(same[rng.integers(same.size)])
+        pairs.append(((int(nys[s_idx]), int(nxs[s_idx])), (int(nys[g_idx]), int(nxs[g_idx]))))
+    return pairs
+
+
+def latency_stats(prefix, latencies, expanded):
+    '''p50/p99/mean of the query latencies in ms and the mean expansions.'''
+    if not latencies:
+        return {}
+    lat_ms = np.array(latencies) * 1000
+    return {f'{prefix}_p50_ms': float(np.percentile(lat_ms, 50)),
+            f'{prefix}_p99_ms': float(np.percentile(lat_ms, 99)),
+            f'{prefix}_mean_ms': float(lat_ms.mean()),
+            f'{prefix}_expanded': float(np.mean(expanded))}
+
+
+def bench_case(case):
+    '''Runs all measurements of one map; meant to run in a fresh process,
+    so the peak RSS belongs to this map alone.'''
+    name, source, cfg = case
+    rng = np.random.default_rng(cfg['seed'])
+    res = {'map': name}
+
+    m2g, res['load_s'] = timed(M2G, source)
+    res['gridsize'] = [m2g.gsy, m2g.gsx]
+    res['rss_matrix_kb'] = peak_rss()
+
+    if cfg['loop']:
+        loop_m2g = M2G(mask_file(m2g.mtrx))
+        _graph, res['build_loop_s'] = timed(loop_m2g.maze2graph)
+        del loop_m2g, _graph
+    _graph, res['build_vec_s'] = timed(m2g.maze2graph_vec)
+    graph = m2g.graph
+    res['keycount'] = len(graph)
+    res['valcount'] = sum(map(len, graph.values()))
+    res['rss_dict_kb'] = peak_rss()
+    labels, res['labels_s'] = timed(m2g.label_components)
+    csr, res['build_csr_s'] = timed(m2g.maze2csr)
+    res['csr_bytes'] = sum(arr.nbytes for arr in (csr.cells, csr.offsets, csr.neighbors, csr.dircodes))
+
+    pairs = query_pairs(labels, cfg['queries'], rng)
+    res['queries'] = len(pairs)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_file = Path(tmp_dir, 'graph.m2g')
+        _none, res['bin_write_s'] = timed(csr.write, bin_file)
+        _csr, res['bin_load_s'] = timed(CsrGraph.read, bin_file)
+        if pairs:
+            # time to the first answer on the memory-mapped graph
+            _found, res['bin_first_query_s'] = timed(GraphPathSearch(_csr, *pairs[0]).a_star_pathsearch)
+        res['bin_bytes'] = bin_file.stat().st_size
+        del _csr
+        npz_file = Path(tmp_dir, 'graph.npz')
+        _none, res['npz_save_s'] = timed(csr.save, npz_file)
+        _csr, res['npz_load_s'] = timed(CsrGraph.load, npz_file)
+        res['npz_bytes'] = npz_file.stat().st_size
+
+    for mode in ('astar', 'bidir'):
+        latencies, expanded = [], []
+        for start, goal in pairs:
+            gps = GraphPathSearch(graph, start, goal, labels)
+            search = gps.a_star_pathsearch if mode == 'astar' else gps.bidirectional_pathsearch
+            _found, q_time = timed(search)
+            latencies.append(q_time)
+            expanded.append(gps.stats.get('expanded', 0))
+        res.update(latency_stats(mode, latencies, expanded))
+
+    bps = BatchPathSearch(csr)
+    _found, batch_s = timed(bps.run, pairs)
+    res['batch_q_ms'] = batch_s * 1000 / max(len(pairs), 1)
+    res['peak_rss_kb'] = peak_rss()
+    return res
+
+
+def run_cases(cases, isolate=True):
+    '''Benchmarks the cases one after another; with `isolate` every case
+    gets a fresh (spawned) interpreter.'''
+    results = []
+    for case in cases:
+        print(f'Benchmarking {case[0]} ...', flush=True)
+        if isolate:
+            with mp.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+                results.append(pool.apply(bench_case, (case,)))
+        else:
+            results.append(bench_case(case))
+    return results
+
+
+def build_cases(cfg):
+    '''Collects the maps to benchmark as (name, image source, settings).'''
+    settings = {'seed': cfg.seed, 'queries': cfg.queries, 'loop': cfg.loop}
+    rng = np.random.default_rng(cfg.seed)
+    cases = []
+    for kind in cfg.kinds:
+        for size in cfg.sizes:
+            mtrx = GENERATORS[kind](size, rng)
+            cases.append((f'{kind}{size}', mask_file(mtrx), settings))
+    if not cfg.no_masks:
+        here = Path(__file__).resolve().parent
+        for mask in SHIPPED_MASKS:
+            if Path(here, mask).is_file():
+                cases.append((mask, str(Path(here, mask)), settings))
+    return cases
+
+
+def compare(results, old_file, threshold):
+    '''Prints the ratio new/old of the tracked metrics for every map of a
+    earlier run; ratios above the threshold are marked as regression.'''
+    with open(old_file, 'r') as ofi:
+        old = {res['map']: res for res in json.load(ofi)['results']}
+    regressions = 0
+    for res in results:
+        if res['map'] not in old:
+            continue
+        for key in TRACKED:
+            old_val, new_val = old[res['map']].get(key), res.get(key)
+            if not old_val or new_val is None:
+                continue
+            ratio = new_val / old_val
+            mark = '  <-- regression' if ratio > threshold else ''
+            regressions += bool(mark)
+            print(f'{res["map"]:>20} {key:>16}: {old_val:12.4f} -> {new_val:12.4f} ({ratio:5.2f}x){mark}')
+    return regressions
+
+
+def get_args():
+    '''Parses the benchmark settings.'''
+
+    parser = argparse.ArgumentParser(description='Benchmarks graph build, graph files and path search.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[128, 512, 1024],
+                        help='Edge lengths of the generated maps.')
+    parser.add_argument('-k', '--kinds', nargs='+', choices=sorted(GENERATORS), default=sorted(GENERATORS),
+                        help='Kinds of generated maps.')
+    parser.add_argument('-q', '--queries', type=int, default=100,
+                        help='Random queries per map.')
+    parser.add_argument('--seed', type=int, default=2024, help='Seed for maps and queries.')
+    parser.add_argument('--loop', action='store_true',
+                        help='Also time the slow per pixel graph build.')
+    parser.add_argument('--no-masks', action='store_true', help='Skip the shipped masks.')
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='Run all maps in this process (peak RSS is then cumulative).')
+    parser.add_argument('-o', '--out', default='pathbench.json', help='JSON result file.')
+    parser.add_argument('--compare', metavar='OLD_JSON',
+                        help='Result file of a earlier run to compare with.')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Ratio new/old above which a metric counts as regression.')
+    return parser.parse_args()
+
+
+def main(cfg):
+    '''...main function.'''
+
+    results = run_cases(build_cases(cfg), isolate=not cfg.no_isolate)
+    report = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'versions': {mod.__title__: mod.__version__ for mod in
+                           (maze2graph, astar_search, csrgraph, path_service, sys.modules[__name__])},
+              'settings': {'seed': cfg.seed, 'queries': cfg.queries},
+              'results': results}
+    with open(cfg.out, 'w') as nfi:
+        json.dump(report, nfi, indent=2)
+
+    for res in results:
+        print(f'{res["map"]:>20}: build {res["build_vec_s"]:.3f}s  csr {res["build_csr_s"]:.3f}s  '
+              f'A* p50/p99 {res.get("astar_p50_ms", 0):.2f}/{res.get("astar_p99_ms", 0):.2f}ms  '
+              f'peak RSS {res["peak_rss_kb"] / 1024:.0f}MiB')
+    if cfg.compare:
+        return compare(results, cfg.compare, cfg.threshold)
+    return 0
+
+
+if __name__ == '__main__':
+    if not sys.version_info >= (3, 6):
+        raise ValueError("Python 3.6 or higher needet.")
+    sys.exit(1 if main(get_args()) else 0)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+'''
+Route cache in front of `GraphPathSearch`: repeated (start, goal) queries are
+answered from a LRU store of found paths, also every query whose start and
+goal both lie on a cached path (a part of a optimal path is optimal too).
+'''
+
+# pylint: disable=w0511, C0103, C0301, r1710
+
+
+from collections import OrderedDict
+from astar_search import CostTable, GraphPathSearch
+
+__title__ = 'route_cache'
+__license__ = 'MIT'
+__author__ = 'madeddy'
+__status__ = 'Development'
+__version__ = '0.1.0-alpha'
+
+
+class RouteCache:
+    '''
+    LRU cache of pathways for one graph (dict or `CsrGraph`).
+
+    maxsize    - number of cached routes
+    max_cells  - optional limit for the sum of the route lengths
+    bucket     - optional edge length of coarse cell buckets; a miss can then
+                 reuse the route of a nearby start/goal pair, joined by two
+                 short searches. Such paths are not always optimal.
+
+    `attach(m2g)` keeps the cache valid over patches of `M2G`: closed cells
+    drop only the routes through them, opened (or cheaper) cells could make
+    any route suboptimal and clear the cache.
+    '''
+
+    def __init__(self, graphdict, labels=None, costs=None, maxsize=1024, max_cells=None, bucket=None):
+        self.graph = graphdict
+        self.labels = labels
+        # prepared once; every miss searches with it
+        self.costs = CostTable(costs) if costs is not None and not isinstance(costs, CostTable) else costs
+        self.maxsize = maxsize
+        self.max_cells = max_cells
+        self.bucket = bucket
+        # (start, goal) -> (pathway, cumulated costs along the pathway)
+        self.routes = OrderedDict()
+        # node -> {route key: position of the node in the route}
+        self.index = {}
+        self.buckets = {}
+        self.cells = 0
+        self.m2g = None
+        self.revision = None
+        self.stats = dict.fromkeys(('hits', 'subpath_hits', 'bucket_hits', 'misses',
+                                    'evictions', 'invalidations'), 0)
+
+    def search(self, start, goal):
+        '''A uncached search; returns the pathway and its costs.'''
+        gps = GraphPathSearch(self.graph, start, goal, self.labels, self.costs)
+        pathway, _cur_cost = gps.a_star_pathsearch()
+        if not pathway:
+            return [], None
+        # costs along the pathway, for the parts of it
+        cumulated = [0.0]
+        for cur_node, nxt_node in zip(pathway, pathway[1:]):
+            cumulated.append(cumulated[-1] + gps.step_cost(cur_node, nxt_node))
+        return pathway, cumulated
+
+    def bucket_key(self, start, goal):
+        '''Key of the coarse cells of a start/goal pair.'''
+        size = self.bucket
+        return start[0] // size, start[1] // size, goal[0] // size, goal[1] // size
+
+    def query(self, start, goal):
+        '''Returns the pathway from start to goal and its costs; ([], None)
+        if there is no path.'''
+        if self.m2g is not None and self.m2g.revision != self.revision:
+            # patched without the hook; nothing is known to be valid
+            self.clear()
+            self.revision = self.m2g.revision
+
+        key = (start, goal)
+        if key in self.routes:
+            self.routes.move_to_end(key)
+            self.stats['hits'] += 1
+            pathway, cumulated = self.routes[key]
+            return list(pathway), cumulated[-1]
+
+        found = self.subpath(start, goal)
+        if found is not None:
+            self.stats['subpath_hits'] += 1
+            return found
+
+        if self.bucket:
+            found = self.bucket_route(start, goal)
+            if found is not None:
+                self.stats['bucket_hits'] += 1
+                return found
+
+        self.stats['misses'] += 1
+        pathway, cumulated = self.search(start, goal)
+        if not pathway:
+            return [], None
+        self.store(key, pathway, cumulated)
+        return list(pathway), cumulated[-1]
+
+    def subpath(self, start, goal):
+        '''Looks for a cached route with start and goal on it; the links of
+        maze2graph are symmetric, so it can be used backwards too.'''
+        on_start, on_goal = self.index.get(start), self.index.get(goal)
+        if not on_start or not on_goal:
+            return None
+        if len(on_goal) < len(on_start):
+            on_start, on_goal = on_goal, on_start
+            start, goal = goal, start
+            backwards = True
+        else:
+            backwards = False
+        for key, s_pos in on_start.items():
+            g_pos = on_goal.get(key)
+            if g_pos is None:
+                continue
+            self.routes.move_to_end(key)
+            pathway, cumulated = self.routes[key]
+            cost = abs(cumulated[g_pos] - cumulated[s_pos])
+            if s_pos <= g_pos:
+                part = pathway[s_pos:g_pos + 1]
+            else:
+                part = pathway[g_pos:s_pos + 1][::-1]
+            return (part[::-1] if backwards else list(part)), cost
+        return None
+
+    def bucket_route(self, start, goal):
+        '''Joins the cached route of the same coarse cells with the start
+        and the goal by two short searches.'''
+        key = self.buckets.get(self.bucket_key(start, goal))
+        if key is None or key not in self.routes:
+            return None
+        pathway, cumulated = self.routes[key]
+        head, head_cum = self.search(start, pathway[0])
+        tail, tail_cum = self.search(pathway[-1], goal)
+        if not head or not tail:
+            return None
+        self.routes.move_to_end(key)
+        return head[:-1] + list(pathway) + tail[1:], head_cum[-1] + cumulated[-1] + tail_cum[-1]
+
+    def store(self, key, pathway, cumulated):
+        '''Adds a route and evicts the least recently used ones over the
+        limits.'''
+        self.routes[key] = (tuple(pathway), cumulated)
+        for pos, node in enumerate(pathway):
+            self.index.setdefault(node, {}).setdefault(key, pos)
+        self.cells += len(pathway)
+        if self.bucket:
+            self.buckets[self.bucket_key(*key)] = key
+        while len(self.routes) > self.maxsize or (self.max_cells and self.cells > self.max_cells
+                                                  and len(self.routes) > 1):
+            self.drop(next(iter(self.routes)))
+            self.stats['evictions'] += 1
+
+    def drop(self, key):
+        '''Removes a route from the cache and its indexes.'''
+        pathway, _cumulated = self.routes.pop(key)
+        for node in pathway:
+            on_node = self.index.get(node)
+            if on_node is not None:
+                on_node.pop(key, None)
+                if not on_node:
+                    del self.index[node]
+        self.cells -= len(pathway)
+        if self.bucket and self.buckets.get(self.bucket_key(*key)) == key:
+            del self.buckets[self.bucket_key(*key)]
+
+    def clear(self):
+        '''Empties the cache.'''
+        if self.routes:
+            self.stats['invalidations'] += len(self.routes)
+        self.routes.clear()
+        self.index.clear()
+        self.buckets.clear()
+        self.cells = 0
+
+    def attach(self, m2g):
+        '''Registers the cache as patch hook of a `M2G`.'''
+        self.m2g = m2g
+        self.revision = m2g.revision
+        m2g.patch_hooks.append(self.patch_hook)
+
+    def patch_hook(self, m2g, box):
+        '''Invalidates after a patch of the box (y_min, y_max, x_min, x_max).
+        If all cells of the box are unwalkable now, paths got only longer:
+        just the routes through the box are dropped. Else the cache is
+        cleared.'''
+        self.revision = m2g.revision
+        y_min, y_max, x_min, x_max = box
+        if (m2g.mtrx[y_min:y_max, x_min:x_max] != 0).any():
+            if self.costs is not None:
+                # the terrain could be cheaper now
+                self.costs.refresh()
+            self.clear()
+            return
+        keys = set()
+        for y_pos in range(y_min, y_max):
+            for x_pos in range(x_min, x_max):
+                keys.update(self.index.get((y_pos, x_pos), ()))
+        for key in keys:
+            self.drop(key)
+        self.stats['invalidations'] += len(keys)
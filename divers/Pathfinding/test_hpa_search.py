@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+'''Tests of the HPA* cluster graph updates through `M2G.patch_hooks`.'''
+
+import random
+import numpy as np
+from PIL import Image
+from hpa_search import ClusterGraph
+from maze2graph import M2G
+
+
+def graph_state(clgraph):
+    '''Entrances and edges without empty entries, for comparisons.'''
+    entrances = {clst: set(nodes) for clst, nodes in clgraph.entrances.items() if nodes}
+    edges = {node: dict(links) for node, links in clgraph.edges.items() if links}
+    return entrances, edges
+
+
+def test_update_as_patch_hook(tmp_path):
+    rng = random.Random(5)
+    mask = np.array([[rng.random() > 0.3 for _ in range(40)] for _ in range(30)], dtype=np.uint8) * 255
+    img_file = tmp_path / 'mask.png'
+    Image.fromarray(mask).save(img_file)
+
+    m2g = M2G(str(img_file))
+    clgraph = ClusterGraph(m2g.mtrx, cluster_size=8)
+    m2g.patch_hooks.append(clgraph.update)
+    for _ in range(30):
+        y_pos, x_pos = rng.randrange(28), rng.randrange(38)
+        values = np.array([[rng.choice((0, 255)) for _ in range(2)] for _ in range(2)])
+        m2g.patch(y_pos, x_pos, values)
+        assert graph_state(clgraph) == graph_state(ClusterGraph(m2g.mtrx, cluster_size=8))
+
+
+def test_empty_patch_calls_no_hook(tmp_path):
+    img_file = tmp_path / 'mask.png'
+    Image.fromarray(np.full((6, 6), 255, dtype=np.uint8)).save(img_file)
+    m2g = M2G(str(img_file))
+    calls = []
+    m2g.patch_hooks.append(lambda m2g, box: calls.append(box))
+    revision = m2g.revision
+    assert m2g.patch_cells([], 0) is None
+    assert calls == [] and m2g.revision == revision